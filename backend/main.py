@@ -23,6 +23,7 @@ from demos.competitor_analysis.main import router as competitor_analysis_router
 from demos.legal_case_intake.main import router as legal_case_intake_router
 from demos.job_application_form_filling.main import router as job_application_form_filling_router
 from demos.invoice_parser.main import router as invoice_parser_router
+from utils.llm_provider import close_llm_providers
 
 # Load environment variables
 load_dotenv()
@@ -39,6 +40,7 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print("🛑 AI Engineering API shutting down...")
+    await close_llm_providers()
 
 # Create FastAPI app
 app = FastAPI(
@@ -0,0 +1,131 @@
+"""
+Tests for the FireworksAI SSE stream parsing in utils/llm_provider.py
+
+Network reads can split an SSE record anywhere (even inside a "data:" line),
+so these feed the parser artificially split chunks and check that every
+record comes out whole, exactly once.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from utils import llm_provider
+from utils.llm_provider import _drain_sse_records, _iter_sse_data
+
+
+def _record(content: str) -> bytes:
+    payload = {"choices": [{"delta": {"content": content}}]}
+    return b"data: " + json.dumps(payload).encode() + b"\n\n"
+
+
+STREAM = (
+    _record("Hello")
+    + b": keep-alive\n\n"
+    + _record(", world")
+    + b"event: message\r\ndata: {\"choices\": []}\r\n\r\n"
+    + b"data: [DONE]\n\n"
+)
+EXPECTED = [
+    json.dumps({"choices": [{"delta": {"content": "Hello"}}]}).encode(),
+    json.dumps({"choices": [{"delta": {"content": ", world"}}]}).encode(),
+    b'{"choices": []}',
+    b"[DONE]",
+]
+
+
+class _FakeContent:
+    """Stands in for aiohttp's StreamReader, returning fixed chunks"""
+    
+    def __init__(self, chunks):
+        self._chunks = chunks
+    
+    async def iter_chunked(self, size):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _collect(chunks) -> list:
+    async def run():
+        return [record async for record in _iter_sse_data(_FakeContent(chunks))]
+    return asyncio.run(run())
+
+
+def test_drain_keeps_partial_record_until_complete():
+    buffer = bytearray(b'data: {"a": ')
+    data_lines = []
+    assert _drain_sse_records(buffer, data_lines) == []
+    
+    buffer += b'1}\n'
+    assert _drain_sse_records(buffer, data_lines) == []
+    assert data_lines == [b'{"a": 1}']
+    
+    buffer += b'\n'
+    assert _drain_sse_records(buffer, data_lines) == [b'{"a": 1}']
+    assert not buffer and not data_lines
+
+
+def test_drain_joins_multiline_data():
+    buffer = bytearray(b"data: line one\ndata:line two\n\n")
+    assert _drain_sse_records(buffer, []) == [b"line one\nline two"]
+
+
+@pytest.mark.parametrize("split_at", range(1, len(STREAM)))
+def test_split_at_every_byte(split_at):
+    assert _collect([STREAM[:split_at], STREAM[split_at:]]) == EXPECTED
+
+
+def test_one_byte_chunks():
+    assert _collect([STREAM[i:i + 1] for i in range(len(STREAM))]) == EXPECTED
+
+
+def test_trailing_record_without_blank_line_is_flushed_at_eof():
+    assert _collect([b"data: [DONE]"]) == [b"[DONE]"]
+
+
+class _FakeResponse:
+    status = 200
+    headers = {}
+    
+    def __init__(self, chunks):
+        self.content = _FakeContent(chunks)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeSession:
+    def __init__(self, chunks):
+        self._chunks = chunks
+    
+    def post(self, url, **kwargs):
+        return _FakeResponse(self._chunks)
+
+
+def _stream(chunks, monkeypatch) -> list:
+    pytest.importorskip("aiohttp")
+    monkeypatch.setenv("LLM_RPS", "0")
+    provider = llm_provider.FireworksAIProvider(api_key="test")
+    
+    async def fake_session(self):
+        return _FakeSession(chunks)
+    monkeypatch.setattr(llm_provider.FireworksAIProvider, "_get_session", fake_session)
+    
+    async def run():
+        return [text async for text in provider.generate_stream("hi")]
+    return asyncio.run(run())
+
+
+def test_generate_stream_reassembles_split_records(monkeypatch):
+    chunks = [STREAM[i:i + 7] for i in range(0, len(STREAM), 7)]
+    assert _stream(chunks, monkeypatch) == ["Hello", ", world"]
+
+
+def test_generate_stream_raises_on_malformed_record(monkeypatch):
+    chunks = [_record("ok"), b'data: {"choices": [\n\n', b"data: [DONE]\n\n"]
+    with pytest.raises(Exception, match="malformed JSON"):
+        _stream(chunks, monkeypatch)
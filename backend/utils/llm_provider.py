@@ -18,16 +18,95 @@ Step 1: Abstract Base Class - Define the contract all providers must follow
 Step 2: Cloud Providers - Learn how to integrate commercial AI APIs
 Step 3: Factory Pattern - Automatically select the right provider
 
+Then, optionally: utils/llm_runtime.py - the runtime helpers the providers use
+(stream buffering and coalescing, adaptive rate limiting, response caching)
+
 Key Concept: This uses the "Provider Pattern" - all providers implement
 the same interface, so you can swap them without changing your code!
 """
 
 import os
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, NamedTuple, Optional
+import contextlib
+import functools
+import importlib.util
 import json
 import asyncio
+import logging
+import random
 import re
+import threading
+
+# Runtime plumbing (buffering, coalescing, rate limiting, caching) lives in its
+# own module so this file reads as the provider lesson, top to bottom
+from .llm_runtime import (
+    RESPONSE_CACHE,
+    ResponseCache,
+    buffered,
+    coalesced,
+    parse_retry_after,
+    rate_limiter_from_env,
+)
+
+logger = logging.getLogger(__name__)
+
+# orjson is optional: it parses bytes directly, serializes straight to bytes and
+# is several times faster than the stdlib json module, which matters in
+# per-request payload encoding and per-token streaming loops.
+#
+# It is imported on first use rather than at import time, like the provider
+# SDKs: _json_loads / _json_dumps start as stubs that pick the implementation,
+# rebind the module globals to it and delegate, so later calls go straight to
+# orjson (or json) with no extra indirection.
+def _stdlib_json_dumps(obj) -> bytes:
+    # Match orjson: compact separators, UTF-8 bytes out
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _bind_json():
+    global _json_loads, _json_dumps
+    try:
+        import orjson
+        _json_loads, _json_dumps = orjson.loads, orjson.dumps
+    except ImportError:
+        _json_loads, _json_dumps = json.loads, _stdlib_json_dumps
+
+
+def _json_loads(data):
+    _bind_json()
+    return _json_loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    _bind_json()
+    return _json_dumps(obj)
+
+
+def _module_available(name: str) -> bool:
+    """
+    Check whether a module can be imported, without actually importing it.
+    
+    Provider SDKs are heavy (genai pulls grpc/protobuf, openai pulls httpx/pydantic),
+    so we only probe for them here and import lazily when a provider is created.
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        # Raised when a parent package (e.g. "google") is missing
+        return False
+
+
+@functools.cache
+def _lazy_import(module_name: str, pip_name: str):
+    """
+    Import a provider SDK on first use; later calls return the cached module.
+    
+    Raises ImportError with an install hint if the package is missing.
+    """
+    if not _module_available(module_name):
+        raise ImportError(f"{pip_name} is not installed. Install it with: pip install {pip_name}")
+    return importlib.import_module(module_name)
 
 # ============================================================================
 # POST-PROCESSING UTILITIES
@@ -98,13 +177,55 @@ class LLMProvider(ABC):
     must implement. This is what makes the "Provider Pattern" work!
     """
     
-    @abstractmethod
+    # Providers are plain attribute holders: subclasses declare __slots__ so
+    # instances skip the per-object __dict__. Empty here so that works.
+    __slots__ = ()
+    
     async def generate_text(self, prompt: str, **kwargs) -> str:
         """
         Generate complete text from a prompt (non-streaming)
         
         Returns the full response as a single string.
         Use this when you don't need real-time streaming.
+        
+        This is a template method: it checks the opt-in response cache, and on
+        a miss calls the provider's _generate_text_impl(). Pass cache=False
+        to always call the provider.
+        """
+        cache_dir = os.getenv("LLM_CACHE_DIR")
+        temperature = kwargs.get('temperature')
+        use_cache = (
+            kwargs.pop('cache', True)
+            and (cache_dir or os.getenv("LLM_RESPONSE_CACHE") == "1")
+            # Multimodal prompts (lists of parts) are not cached
+            and isinstance(prompt, str)
+            # A missing temperature means the provider's default, which is > 0
+            and (temperature == 0 or os.getenv("LLM_CACHE_SAMPLED") == "1")
+        )
+        if not use_cache:
+            return await self._generate_text_impl(prompt, **kwargs)
+        
+        model = getattr(self, 'model_name', None) or getattr(self, 'model', '')
+        # The API key scopes entries per tenant; it only enters the hash
+        api_key = getattr(self, 'api_key', None) or getattr(getattr(self, 'client', None), 'api_key', '')
+        key = ResponseCache.make_key(
+            f"{type(self).__name__}|{api_key}", model, kwargs, prompt
+        )
+        cached = RESPONSE_CACHE.get(key, float(os.getenv("LLM_CACHE_TTL", "3600")), cache_dir)
+        if cached is not None:
+            return cached
+        
+        text = await self._generate_text_impl(prompt, **kwargs)
+        if text is not None:
+            RESPONSE_CACHE.set(key, text, cache_dir)
+        return text
+    
+    @abstractmethod
+    async def _generate_text_impl(self, prompt: str, **kwargs) -> str:
+        """
+        Provider-specific text generation, called by generate_text()
+        
+        Implement this (not generate_text) in new providers.
         """
         pass
     
@@ -118,6 +239,131 @@ class LLMProvider(ABC):
         """
         pass
     
+    async def generate_stream_bytes(self, prompt: str, **kwargs) -> AsyncGenerator[bytes, None]:
+        """
+        Generate streaming text as UTF-8 bytes
+        
+        Handy when chunks go straight to a socket (e.g. a raw StreamingResponse):
+        each chunk is encoded exactly once here instead of by every consumer.
+        Providers with a native bytes source can override this.
+        """
+        async for chunk in self.generate_stream(prompt, **kwargs):
+            yield chunk.encode('utf-8')
+    
+    async def generate_text_from_stream(self, prompt: str, **kwargs) -> str:
+        """
+        Get the complete streamed response as one string
+        
+        Use this instead of joining generate_stream() chunks yourself when you
+        only need the final text. The default joins the stream; providers whose
+        non-streaming API is cheaper override it to skip per-chunk work.
+        """
+        parts = []
+        async for chunk in self.generate_stream(prompt, **kwargs):
+            parts.append(chunk)
+        return ''.join(parts)
+    
+    async def generate_batch(
+        self,
+        prompts: list[str],
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+        **kwargs
+    ) -> list:
+        """
+        Generate text for many prompts concurrently
+        
+        Instead of awaiting each prompt one after another, requests are fanned
+        out as concurrent tasks. A semaphore caps how many are in flight so we
+        don't trip provider rate limits; lower `concurrency` if the provider
+        starts answering with 429s.
+        
+        Args:
+            prompts: Prompts to complete
+            concurrency: Maximum number of requests in flight at once
+            return_exceptions: If True, a failed prompt yields its exception in
+                the results list instead of failing the whole batch. If False,
+                the first failure cancels the outstanding requests and is raised
+            **kwargs: Passed through to generate_text (temperature, max_tokens, ...)
+            
+        Returns:
+            Generated texts (or exceptions), in the same order as prompts
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _generate_one(prompt: str) -> str:
+            async with semaphore:
+                return await self.generate_text(prompt, **kwargs)
+        
+        if return_exceptions:
+            return await asyncio.gather(
+                *(_generate_one(prompt) for prompt in prompts),
+                return_exceptions=True
+            )
+        
+        # A TaskGroup cancels the remaining requests as soon as one fails, and
+        # never returns while any request is still in flight (gather would
+        # leave them running in the background, still holding rate-limit quota)
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [group.create_task(_generate_one(prompt)) for prompt in prompts]
+        except BaseExceptionGroup as eg:
+            # Surface the first real error, as gather did
+            raise eg.exceptions[0] from eg
+        return [task.result() for task in tasks]
+    
+    async def generate_text_batch(
+        self,
+        prompts: list[str],
+        *,
+        max_concurrency: int = 16,
+        return_exceptions: bool = True,
+        **kwargs
+    ) -> list:
+        """
+        Generate text for many prompts concurrently (generate_text_* naming)
+        
+        Same as generate_batch(), with its limit named max_concurrency and a
+        default of 16 requests in flight. Failures are returned in place by
+        default: results[i] is either the completion for prompts[i] or the
+        exception it raised. Pass return_exceptions=False to raise the first
+        failure instead.
+        """
+        return await self.generate_batch(
+            prompts, concurrency=max_concurrency, return_exceptions=return_exceptions, **kwargs
+        )
+    
+    async def generate_text_n(self, prompt: str, n: int = 1, **kwargs) -> list[str]:
+        """
+        Generate n independent completions of the same prompt
+        
+        Useful for best-of-N / self-consistency. Providers that support it ask
+        the API for n choices in one request, so the prompt is sent and
+        processed once. This default falls back to n concurrent requests.
+        
+        Pass temperature > 0, otherwise the n completions will be (near) identical.
+        """
+        return await self.generate_batch([prompt] * n, **kwargs)
+    
+    async def _prewarm(self) -> None:
+        """
+        Open a connection to the provider ahead of the first real request.
+        
+        DNS lookup + TLS handshake add ~100ms+ to the first call. Providers that
+        keep a connection pool override this to establish a connection early.
+        Best-effort: implementations must never raise.
+        """
+        return None
+    
+    async def aclose(self) -> None:
+        """
+        Release network resources (connection pools, sessions) held by the provider.
+        
+        Providers that keep long-lived connections override this. Call it on
+        application shutdown.
+        """
+        return None
+    
     async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
         """
         Generate image from an input image and prompt (image-to-image)
@@ -153,822 +399,1076 @@ Key Concepts:
 """
 
 # Google Gemini Provider
-try:
-    import google.generativeai as genai
-    import asyncio
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    genai = None
-
-if GEMINI_AVAILABLE:
-    def _is_gemini_content_blocked(candidate) -> bool:
-        """
-        Check if Gemini response was blocked by safety filters.
-        
-        Args:
-            candidate: Gemini response candidate object
-            
-        Returns:
-            True if content was blocked, False otherwise
-        """
-        # Finish reason 2 (SAFETY) means content was blocked
-        if hasattr(candidate, 'finish_reason') and candidate.finish_reason == 2:
-            return True
-        return False
+GEMINI_AVAILABLE = _module_available("google.generativeai")
+genai = None  # Imported lazily by _import_genai()
+
+
+def _import_genai():
+    """Import google.generativeai on first use and cache it at module level."""
+    global genai
+    if genai is None:
+        genai = _lazy_import("google.generativeai", "google-generativeai")
+    return genai
+
+
+@functools.lru_cache(maxsize=32)
+def _gemini_generation_config(temperature: float, max_tokens: int, candidate_count: int = 1):
+    """
+    Build (and memoize) a GenerationConfig for the given sampling settings.
     
-    def _extract_text_from_gemini_chunk(chunk) -> Optional[str]:
-        """
-        Extract text from a Gemini streaming chunk.
-        
-        For streaming responses, Gemini returns incremental text chunks.
-        Each chunk contains the NEW text since the last chunk (not cumulative).
+    Callers use a handful of (temperature, max_tokens) pairs, so reusing the
+    config object skips re-validating it on every request.
+    """
+    if candidate_count != 1:
+        return genai.types.GenerationConfig(
+            temperature=temperature,
+            max_output_tokens=max_tokens,
+            candidate_count=candidate_count,
+        )
+    return genai.types.GenerationConfig(
+        temperature=temperature,
+        max_output_tokens=max_tokens,
+    )
+
+
+# Candidate.finish_reason value for SAFETY (content blocked by filters)
+_GEMINI_BLOCKED_REASON = 2
+
+
+def _is_gemini_content_blocked(candidate) -> bool:
+    """
+    Check if Gemini response was blocked by safety filters.
+    
+    Args:
+        candidate: Gemini response candidate object
         
-        Args:
-            chunk: Gemini streaming chunk object
-            
-        Returns:
-            Extracted text (can be empty string) or None if no text found
-        """
-        # Strategy 1: Try direct text attribute (works for some API versions)
-        try:
-            if hasattr(chunk, 'text'):
-                text = chunk.text
-                # Return even if empty string (empty is valid for streaming)
-                if text is not None:
-                    return text
-        except (AttributeError, ValueError):
-            pass
+    Returns:
+        True if content was blocked, False otherwise
+    """
+    return getattr(candidate, 'finish_reason', None) == _GEMINI_BLOCKED_REASON
+
+
+def _extract_text_from_gemini_chunk(chunk) -> Optional[str]:
+    """
+    Extract text from a Gemini streaming chunk.
+    
+    For streaming responses, Gemini returns incremental text chunks.
+    Each chunk contains the NEW text since the last chunk (not cumulative).
+    
+    This runs once per streamed chunk, so it does one getattr(..., None) per
+    level instead of hasattr() probes followed by a second lookup (a failing
+    hasattr builds and discards an AttributeError).
+    
+    Args:
+        chunk: Gemini streaming chunk object
         
-        # Strategy 2: Extract from candidates -> content -> parts (most common for streaming)
-        try:
-            if hasattr(chunk, 'candidates') and chunk.candidates:
-                if len(chunk.candidates) > 0:
-                    candidate = chunk.candidates[0]
-                    
-                    # Check for content with parts
-                    if hasattr(candidate, 'content') and candidate.content:
-                        if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                            # Iterate through all parts to find text
-                            for part in candidate.content.parts:
-                                # Check if part has text attribute
-                                if hasattr(part, 'text'):
-                                    text = part.text
-                                    # Return even if empty string
-                                    if text is not None:
-                                        return text
-                    
-                    # Try direct candidate.text if available
-                    if hasattr(candidate, 'text'):
-                        text = candidate.text
-                        if text is not None:
-                            return text
-        except (AttributeError, IndexError, ValueError, TypeError):
-            # Log but don't fail - try next strategy
-            pass
-        
-        # Strategy 3: Try accessing text via getattr (more defensive)
-        try:
-            text = getattr(chunk, 'text', None)
-            if text is not None:
+    Returns:
+        Extracted text, or None if the chunk carries no text
+    """
+    # Fast path: the .text accessor. getattr(..., None) alone isn't enough here:
+    # the SDK raises ValueError (not AttributeError) when there is no text part
+    try:
+        text = getattr(chunk, 'text', None)
+        if text:
+            return text
+    except ValueError:
+        pass
+    
+    # Fallback: candidates -> content -> parts, first part with text wins
+    candidates = getattr(chunk, 'candidates', None)
+    if candidates:
+        content = getattr(candidates[0], 'content', None)
+        for part in getattr(content, 'parts', None) or ():
+            text = getattr(part, 'text', None)
+            if text:
                 return text
-        except (AttributeError, ValueError):
-            pass
+    return None
+
+
+def _extract_text_from_gemini_response(response) -> str:
+    """
+    Extract text from a complete Gemini response.
+    
+    Args:
+        response: Complete Gemini response object
         
-        # Strategy 4: Try to access via __dict__ or dir() if available (last resort)
-        try:
-            if hasattr(chunk, '__dict__'):
-                for key in ['text', 'content', 'delta']:
-                    if hasattr(chunk, key):
-                        value = getattr(chunk, key, None)
-                        if isinstance(value, str):
-                            return value
-        except (AttributeError, ValueError):
-            pass
+    Returns:
+        Extracted text as string
         
-        return None
+    Raises:
+        ValueError: If no text can be extracted
+    """
+    # Try direct text extraction first
+    try:
+        return response.text
+    except ValueError:
+        pass
+    
+    # Fallback: Extract from parts manually
+    if response.candidates and len(response.candidates) > 0:
+        candidate = response.candidates[0]
+        parts = candidate.content.parts if candidate.content else None
+        if parts:
+            # Single-part responses (the common case) need no list or join
+            if len(parts) == 1:
+                text = getattr(parts[0], 'text', None)
+                if text:
+                    return text
+            else:
+                text = ''.join(getattr(part, 'text', None) or '' for part in parts)
+                if text:
+                    return text
+    
+    raise ValueError("Failed to extract text from Gemini response")
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini Provider
+    
+    Pros: Free tier available, good quality
+    Cons: Requires internet connection, rate limits
     
-    def _extract_text_from_gemini_response(response) -> str:
+    How it works:
+    1. Configure with API key
+    2. Create GenerativeModel instance
+    3. Call generate_content() with prompt
+    4. Stream chunks as they arrive
+    """
+    
+    __slots__ = ("api_key", "model_name", "model", "_model_loop", "_bucket")
+    
+    def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
+        _import_genai()
+        self.api_key = api_key
+        self.model_name = model
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+        self._model_loop = None
+        self._bucket = rate_limiter_from_env()
+    
+    def _loop_model(self):
         """
-        Extract text from a complete Gemini response.
+        Return a GenerativeModel usable in the running event loop.
         
-        Args:
-            response: Complete Gemini response object
-            
-        Returns:
-            Extracted text as string
-            
-        Raises:
-            ValueError: If no text can be extracted
+        The SDK's async calls go through one process-wide gRPC client that is
+        bound to the loop it was created in (possibly by another provider).
+        When this (cached) provider is first used in a loop, re-running
+        configure() drops that client so the next call builds one for the
+        current loop.
         """
-        # Try direct text extraction first
-        try:
-            return response.text
-        except ValueError:
-            pass
-        
-        # Fallback: Extract from parts manually
-        if response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if candidate.content and candidate.content.parts:
-                text_parts = []
-                for part in candidate.content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        text_parts.append(part.text)
-                if text_parts:
-                    return ''.join(text_parts)
-        
-        raise ValueError("Failed to extract text from Gemini response")
-    
-    class GeminiProvider(LLMProvider):
+        loop = asyncio.get_running_loop()
+        if self._model_loop is not loop:
+            genai.configure(api_key=self.api_key)
+            self.model = genai.GenerativeModel(self.model_name)
+            self._model_loop = loop
+        return self.model
+    
+    async def _generate_text_impl(self, prompt: str, **kwargs) -> str:
         """
-        Google Gemini Provider
+        Generate text using Gemini.
         
-        Pros: Free tier available, good quality
-        Cons: Requires internet connection, rate limits
+        Handles Gemini-specific error cases:
+        - No candidates returned
+        - Content blocked by safety filters
+        - Text extraction failures
         
-        How it works:
-        1. Configure with API key
-        2. Create GenerativeModel instance
-        3. Call generate_content() with prompt
-        4. Stream chunks as they arrive
+        Safety Settings:
+        - Uses default Gemini safety settings
+        - Can be controlled via kwargs['safety_settings'] if needed
         """
+        # Default temperature: 0.3 (more deterministic, can be overridden via kwargs)
+        temperature = kwargs.get('temperature', 0.3)
         
-        def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
-            self.api_key = api_key
-            self.model_name = model
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel(model)
+        await self._bucket.acquire()
         
-        async def generate_text(self, prompt: str, **kwargs) -> str:
-            """
-            Generate text using Gemini.
-            
-            Handles Gemini-specific error cases:
-            - No candidates returned
-            - Content blocked by safety filters
-            - Text extraction failures
-            
-            Safety Settings:
-            - Uses default Gemini safety settings
-            - Can be controlled via kwargs['safety_settings'] if needed
-            """
-            # Default temperature: 0.3 (more deterministic, can be overridden via kwargs)
-            temperature = kwargs.get('temperature', 0.3)
-            
-            # Use default safety settings (no custom overrides)
-            response = await asyncio.to_thread(
-                self.model.generate_content,
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
-                    max_output_tokens=kwargs.get('max_tokens', 400),
-                )
+        # Native async call - no worker thread needed
+        # Use default safety settings (no custom overrides)
+        response = await self._loop_model().generate_content_async(
+            prompt,
+            generation_config=_gemini_generation_config(
+                temperature, kwargs.get('max_tokens', 400)
             )
-            
-            # Validate response has candidates
-            if not response.candidates or len(response.candidates) == 0:
-                raise ValueError("No candidates returned from Gemini API")
-            
-            candidate = response.candidates[0]
-            
-            # Check if content was blocked by safety filters
-            if _is_gemini_content_blocked(candidate):
-                raise ValueError(
-                    "Content was blocked by Gemini safety filters. "
-                    "Try rephrasing your prompt."
-                )
-            
-            # Extract text from response
-            return _extract_text_from_gemini_response(response)
+        )
         
-        async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
-            """
-            Stream text using Gemini.
-            
-            Gemini's API is synchronous, so we use a thread executor and queue
-            to bridge it to async. This handles:
-            - Converting sync generator to async generator
-            - Proper error handling (StopIteration is normal completion)
-            - Clean shutdown
-            
-            Note: Gemini streaming chunks contain incremental text (new text since last chunk),
-            not cumulative text. Each chunk should be yielded immediately.
-            """
-            chunk_queue = asyncio.Queue(maxsize=100)
-            exception_holder = [None]
-            
-            # Get the running event loop (preferred over get_event_loop)
+        # Validate response has candidates
+        if not response.candidates or len(response.candidates) == 0:
+            raise ValueError("No candidates returned from Gemini API")
+        
+        candidate = response.candidates[0]
+        
+        # Check if content was blocked by safety filters
+        if _is_gemini_content_blocked(candidate):
+            raise ValueError(
+                "Content was blocked by Gemini safety filters. "
+                "Try rephrasing your prompt."
+            )
+        
+        # Extract text from response
+        return _extract_text_from_gemini_response(response)
+    
+    async def generate_text_n(self, prompt: str, n: int = 1, **kwargs) -> list[str]:
+        """Generate n completions in one request via GenerationConfig.candidate_count"""
+        temperature = kwargs.get('temperature', 0.3)
+        await self._bucket.acquire()
+        response = await self._loop_model().generate_content_async(
+            prompt,
+            generation_config=_gemini_generation_config(
+                temperature, kwargs.get('max_tokens', 400), n
+            )
+        )
+        
+        texts = []
+        for candidate in response.candidates or ():
+            # Skip candidates blocked by safety filters or without text
+            if _is_gemini_content_blocked(candidate):
+                continue
             try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                loop = asyncio.get_event_loop()
-            
-            def _generate_chunks():
-                """
-                Run synchronous Gemini generation in a thread.
-                
-                This function runs in a separate thread because Gemini's API
-                is synchronous. It puts chunks into a queue for async consumption.
-                """
-                # Default temperature: 0.3 (more deterministic, can be overridden via kwargs)
-                temperature = kwargs.get('temperature', 0.3)
-                
-                try:
-                    # Generate content with streaming enabled (using default safety settings)
-                    response = self.model.generate_content(
-                        prompt,
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=temperature,
-                            max_output_tokens=kwargs.get('max_tokens', 400),
-                        ),
-                        stream=True
-                    )
-                    
-                    # Iterate over streaming chunks
-                    # Gemini's stream=True returns a generator that yields chunks
-                    chunk_count = 0
-                    for chunk in response:
-                        chunk_count += 1
-                        
-                        # Extract text from this chunk using multiple strategies
-                        text = _extract_text_from_gemini_chunk(chunk)
-                        
-                        # If extraction failed, try alternative methods
-                        if not text:
-                            # Try accessing chunk.text directly (might work for some versions)
-                            try:
-                                if hasattr(chunk, 'text'):
-                                    text = chunk.text
-                            except (AttributeError, ValueError):
-                                pass
-                        
-                        # If we still don't have text, try deeper extraction
-                        if not text:
-                            try:
-                                if hasattr(chunk, 'candidates') and chunk.candidates:
-                                    candidate = chunk.candidates[0]
-                                    if hasattr(candidate, 'content') and candidate.content:
-                                        if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                                            for part in candidate.content.parts:
-                                                if hasattr(part, 'text') and part.text:
-                                                    text = part.text
-                                                    break
-                            except (AttributeError, IndexError, ValueError):
-                                pass
-                        
-                        # For Gemini streaming, chunks can be empty strings (incremental updates)
-                        # We should queue them anyway, but skip completely None/empty after trimming
-                        # However, empty strings are valid (they represent no new text in this chunk)
-                        # So we queue any non-None value, including empty strings
-                        if text is not None:
-                            # Put chunk in queue from sync context
-                            # Use run_coroutine_threadsafe to safely call async from sync thread
-                            try:
-                                future = asyncio.run_coroutine_threadsafe(
-                                    chunk_queue.put(text),
-                                    loop
-                                )
-                                # Wait for the put to complete (with timeout to avoid deadlock)
-                                future.result(timeout=2.0)
-                            except Exception:
-                                # If queue is full or other error, continue
-                                # Don't break the stream
-                                pass
-                    
-                    # Normal completion - signal end with None
-                    asyncio.run_coroutine_threadsafe(
-                        chunk_queue.put(None),
-                        loop
-                    )
-                    
-                except StopIteration:
-                    # StopIteration is normal completion when generator ends
-                    asyncio.run_coroutine_threadsafe(
-                        chunk_queue.put(None),
-                        loop
-                    )
-                except Exception as e:
-                    # Real errors - store and signal completion
-                    exception_holder[0] = e
-                    # Still signal completion so async loop doesn't hang
-                    asyncio.run_coroutine_threadsafe(
-                        chunk_queue.put(None),
-                        loop
-                    )
-            
-            # Start generation in a thread using run_in_executor
-            executor_task = loop.run_in_executor(None, _generate_chunks)
+                text = ''.join(part.text for part in candidate.content.parts if part.text)
+            except (AttributeError, ValueError):
+                continue
+            if text:
+                texts.append(text)
+        
+        if not texts:
+            raise ValueError("No usable candidates returned from Gemini API")
+        return texts
+    
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        """
+        Stream text using Gemini.
+        
+        Uses the SDK's native async API (generate_content_async with
+        stream=True), which returns an async iterator of chunks. No worker
+        thread or queue is needed to bridge it into async code.
+        
+        Note: Gemini streaming chunks contain incremental text (new text since last chunk),
+        not cumulative text. Each chunk should be yielded immediately.
+        """
+        # Default temperature: 0.3 (more deterministic, can be overridden via kwargs)
+        temperature = kwargs.get('temperature', 0.3)
+        
+        await self._bucket.acquire()
+        
+        # Generate content with streaming enabled (using default safety settings)
+        response = await self._loop_model().generate_content_async(
+            prompt,
+            generation_config=_gemini_generation_config(
+                temperature, kwargs.get('max_tokens', 400)
+            ),
+            stream=True
+        )
+        
+        async for chunk in response:
+            # Extract text from this chunk using multiple strategies
+            text = _extract_text_from_gemini_chunk(chunk)
             
-            # Yield chunks as they arrive
-            try:
-                while True:
-                    # Get chunk from queue (with timeout to avoid infinite wait)
-                    try:
-                        chunk = await asyncio.wait_for(chunk_queue.get(), timeout=60.0)
-                    except asyncio.TimeoutError:
-                        # Timeout waiting for chunk - likely an error
-                        if exception_holder[0]:
-                            raise exception_holder[0]
-                        raise TimeoutError("Timeout waiting for Gemini streaming response")
-                    
-                    # None signals completion
-                    if chunk is None:
-                        # Check for errors (but StopIteration is normal)
-                        if exception_holder[0]:
-                            if isinstance(exception_holder[0], StopIteration):
-                                # Normal completion
-                                break
-                            raise exception_holder[0]
-                        # Normal completion - no errors
-                        break
-                    
-                    # Apply post-processing to fix spacing and punctuation
-                    chunk = _fix_streaming_chunk_spacing(chunk)
-                    
-                    # Yield the chunk immediately
-                    yield chunk
-                    
-            except RuntimeError as e:
-                # Some async frameworks convert StopIteration to RuntimeError
-                error_str = str(e).lower()
-                if "stopiteration" in error_str or "async generator" in error_str:
-                    # Normal completion, not an error
-                    return
-                raise
-            finally:
-                # Clean up executor - wait for thread to finish
-                try:
-                    await asyncio.wait_for(executor_task, timeout=5.0)
-                except (asyncio.TimeoutError, Exception):
-                    # Executor cleanup failed, but that's okay
-                    pass
-        
-        async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
-            """Generate image using Google Gemini (if image generation is available)"""
-            raise NotImplementedError(
-                "🎓 Learning Challenge: Gemini image generation is not yet implemented!\n\n"
-                "This is a great opportunity to learn:\n"
-                "1. Research Gemini's image generation API\n"
-                "2. Implement the generate_image() method for GeminiProvider\n"
-                "3. Test it with different image inputs\n"
-                "4. Compare results with Fireworks and OpenAI\n\n"
-                "For now, please use Fireworks AI (FLUX) or OpenAI (DALL-E)."
-            )
+            # Empty chunks carry no new text - skip them
+            if text:
+                # Apply post-processing to fix spacing and punctuation
+                yield _fix_streaming_chunk_spacing(text)
+    
+    async def generate_text_from_stream(self, prompt: str, **kwargs) -> str:
+        """One non-streaming generate_content_async call instead of iterating chunks"""
+        return await self.generate_text(prompt, **kwargs)
+    
+    async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
+        """Generate image using Google Gemini (if image generation is available)"""
+        raise NotImplementedError(
+            "🎓 Learning Challenge: Gemini image generation is not yet implemented!\n\n"
+            "This is a great opportunity to learn:\n"
+            "1. Research Gemini's image generation API\n"
+            "2. Implement the generate_image() method for GeminiProvider\n"
+            "3. Test it with different image inputs\n"
+            "4. Compare results with Fireworks and OpenAI\n\n"
+            "For now, please use Fireworks AI (FLUX) or OpenAI (DALL-E)."
+        )
 
 
 # OpenAI Provider
-try:
-    from openai import AsyncOpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    AsyncOpenAI = None
-
-if OPENAI_AVAILABLE:
-    class OpenAIProvider(LLMProvider):
-        """
-        OpenAI Provider (GPT-3.5, GPT-4, etc.)
+OPENAI_AVAILABLE = _module_available("openai")
+_openai = None  # Imported lazily by _import_openai()
+
+
+def _import_openai():
+    """Import the openai SDK on first use and cache it at module level."""
+    global _openai
+    if _openai is None:
+        _openai = _lazy_import("openai", "openai")
+    return _openai
+
+
+# HTTP/2 needs the optional "h2" package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = _module_available("h2")
+
+
+def _openai_http_client():
+    """
+    Build the httpx client for an AsyncOpenAI instance.
+    
+    With HTTP/2, concurrent requests (e.g. generate_batch) are multiplexed over
+    one connection instead of each opening its own socket + TLS session.
+    Falls back to HTTP/1.1 keep-alive when h2 is not installed.
+    """
+    import httpx
+    openai = _import_openai()
+    # DefaultAsyncHttpxClient keeps the SDK's own timeout/redirect defaults (openai>=1.17)
+    client_cls = getattr(openai, "DefaultAsyncHttpxClient", None) or httpx.AsyncClient
+    return client_cls(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    )
+
+
+# AsyncOpenAI clients shared across provider instances, keyed by event loop and
+# connection settings. Each client owns an httpx connection pool, so sharing one
+# keeps connections (and TLS sessions) warm even when providers are created per
+# request. Pooled connections are bound to the loop that opened them, so every
+# loop (e.g. each asyncio.run() or per-test loop) gets its own clients, the same
+# way _FIREWORKS_SESSIONS works.
+_OPENAI_CLIENTS: dict = {}
+_OPENAI_CLIENTS_LOCK = threading.Lock()
+
+
+def _shared_openai_client(api_key: str, base_url: Optional[str] = None,
+                          default_headers: Optional[dict] = None, **options):
+    """
+    Return the running loop's shared AsyncOpenAI client for these settings.
+    
+    Must be called inside a running event loop; providers look their client
+    up on each request rather than holding one from __init__.
+    """
+    loop = asyncio.get_running_loop()
+    key = (
+        loop,
+        api_key,
+        base_url,
+        frozenset((default_headers or {}).items()),
+        frozenset(options.items()),
+    )
+    client = _OPENAI_CLIENTS.get(key)
+    if client is None:
+        with _OPENAI_CLIENTS_LOCK:
+            client = _OPENAI_CLIENTS.get(key)
+            if client is None:
+                # Forget clients whose loop has finished (e.g. an earlier asyncio.run())
+                for stale in [k for k in _OPENAI_CLIENTS if k[0].is_closed()]:
+                    del _OPENAI_CLIENTS[stale]
+                client = _import_openai().AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    default_headers=default_headers,
+                    http_client=_openai_http_client(),
+                    **options
+                )
+                _OPENAI_CLIENTS[key] = client
+    return client
+
+
+async def close_openai_clients() -> None:
+    """Close the shared AsyncOpenAI clients (called by close_llm_providers)"""
+    loop = asyncio.get_running_loop()
+    with _OPENAI_CLIENTS_LOCK:
+        clients = list(_OPENAI_CLIENTS.items())
+        _OPENAI_CLIENTS.clear()
+    for key, client in clients:
+        # A client can only be closed from its own loop; others are dropped
+        if key[0] is not loop:
+            continue
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close OpenAI client: {e}")
+
+
+def _chat_request(template: dict, prompt, kwargs: dict) -> dict:
+    """
+    Build chat-completion request arguments from a provider's prebuilt template.
+    
+    The template holds the per-instance constants (model and default
+    temperature/max_tokens), so each call only copies it and fills in the
+    prompt and any overrides. Shared by the OpenAI-compatible providers.
+    """
+    request = template.copy()
+    if 'temperature' in kwargs:
+        request['temperature'] = kwargs['temperature']
+    if 'max_tokens' in kwargs:
+        request['max_tokens'] = kwargs['max_tokens']
+    request['messages'] = [{"role": "user", "content": prompt}]
+    return request
+
+
+class OpenAIProvider(LLMProvider):
+    """
+    OpenAI Provider (GPT-3.5, GPT-4, etc.)
+    
+    Pros: Industry standard, very high quality
+    Cons: Paid service, requires API key
+    
+    How it works:
+    1. Create AsyncOpenAI client with API key
+    2. Call chat.completions.create() with messages
+    3. For streaming, set stream=True and iterate chunks
+    """
+    
+    __slots__ = ("api_key", "model", "_request_template", "_bucket")
+    
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini"):
+        _import_openai()
+        self.api_key = api_key
+        self.model = model
+        self._request_template = {"model": model, "temperature": 0.8, "max_tokens": 1000}
+        self._bucket = rate_limiter_from_env()
+    
+    @property
+    def client(self):
+        """AsyncOpenAI client for the running loop, shared with other OpenAI providers using the same key"""
+        return _shared_openai_client(self.api_key)
+    
+    async def _prewarm(self) -> None:
+        """Prime the client's connection pool (DNS + TLS) with a cheap models.list()"""
+        try:
+            await self.client.with_options(max_retries=0, timeout=10.0).models.list()
+        except Exception as e:
+            logger.debug(f"OpenAI prewarm failed: {e}")
+    
+    async def _generate_text_impl(self, prompt: str, **kwargs) -> str:
+        """Generate text using OpenAI"""
+        await self._bucket.acquire()
+        response = await self.client.chat.completions.create(
+            **_chat_request(self._request_template, prompt, kwargs)
+        )
+        return response.choices[0].message.content
+    
+    async def generate_text_n(self, prompt: str, n: int = 1, **kwargs) -> list[str]:
+        """Generate n completions in one request with the API's n parameter"""
+        await self._bucket.acquire()
+        response = await self.client.chat.completions.create(
+            **_chat_request(self._request_template, prompt, kwargs),
+            n=n
+        )
+        return [choice.message.content for choice in response.choices]
+    
+    @coalesced
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        """Stream text using OpenAI"""
+        await self._bucket.acquire()
+        stream = await self.client.chat.completions.create(
+            **_chat_request(self._request_template, prompt, kwargs),
+            stream=True
+        )
         
-        Pros: Industry standard, very high quality
-        Cons: Paid service, requires API key
+        # aclosing: if the caller stops early, the read-ahead task and the
+        # HTTP stream are shut down right away, not when garbage-collected
+        async with contextlib.aclosing(buffered(stream)) as chunks:
+            async for chunk in chunks:
+                # Each attribute is looked up once per token. Chunks with no
+                # choices (e.g. a trailing usage-only chunk) are skipped.
+                choices = chunk.choices
+                if not choices:
+                    continue
+                content = choices[0].delta.content
+                if content:
+                    # Apply post-processing to fix spacing and punctuation
+                    yield _fix_streaming_chunk_spacing(content)
+    
+    async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
+        """Generate image using OpenAI GPT Image (image-to-image with edit API)"""
+        import base64
+        import io
+        
+        image_model = kwargs.get('image_model') or os.getenv("IMAGE_MODEL", "gpt-image-1")
+        image_file = io.BytesIO(image_bytes)
+        
+        response = await self.client.images.edit(
+            model=image_model,
+            image=image_file,
+            prompt=prompt,
+            size="1024x1024"
+        )
         
-        How it works:
-        1. Create AsyncOpenAI client with API key
-        2. Call chat.completions.create() with messages
-        3. For streaming, set stream=True and iterate chunks
+        if response.data and len(response.data) > 0:
+            image_b64 = response.data[0].b64_json
+            return base64.b64decode(image_b64)
+        else:
+            raise Exception("No image data in OpenAI response")
+
+
+# OpenRouter Provider (OpenAI-Compatible API)
+OPENROUTER_AVAILABLE = OPENAI_AVAILABLE
+
+
+@functools.lru_cache(maxsize=1)
+def _openrouter_headers() -> dict:
+    """
+    Attribution headers sent with every OpenRouter request, built once.
+    
+    Read on first use rather than at import time, since load_dotenv() usually
+    runs after this module is imported. refresh_provider_config() clears it.
+    """
+    default_headers = {
+        "HTTP-Referer": os.getenv("OPENROUTER_HTTP_REFERER", ""),
+        "X-Title": os.getenv("OPENROUTER_APP_NAME", "AI Engineering by Param Harrison")
+    }
+    # Filter out empty values
+    return {k: v for k, v in default_headers.items() if v}
+
+
+# Statuses worth retrying: rate limited, request timeout, and transient
+# gateway/server errors. Any other 4xx means the request itself is wrong.
+_OPENROUTER_RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class OpenRouterProvider(LLMProvider):
+    """
+    OpenRouter Provider
+    
+    Pros: Access to many models (Claude, GPT-4, Llama, etc.), unified API
+    Cons: Requires internet connection, paid service, rate limits on free models
+    
+    How it works:
+    - Uses OpenAI-compatible API format
+    - Same code structure as OpenAI provider
+    - Just change the base URL and API key
+    - This demonstrates API compatibility patterns!
+    
+    Key Learning: OpenAI-compatible APIs let you use the same code
+    to access different AI providers. This is called "API compatibility".
+    
+    Rate Limiting:
+    - Free models have strict rate limits (429 errors)
+    - This provider includes retry logic with exponential backoff
+    - Consider using paid models for production workloads
+    """
+    
+    __slots__ = ("api_key", "model", "_request_template", "_bucket")
+    
+    def __init__(self, api_key: str, model: str = "minimax/minimax-m2:free"):
+        _import_openai()
+        self.api_key = api_key
+        # Strip openrouter/ prefix if present (used by LiteLLM but not direct OpenRouter API)
+        self.model = model[11:] if model and model.startswith("openrouter/") else model
+        self._request_template = {"model": self.model, "temperature": 0.8, "max_tokens": 1000}
+        self._bucket = rate_limiter_from_env()
+    
+    @property
+    def client(self):
+        """AsyncOpenAI client for the running loop, shared with other OpenRouter providers using the same key"""
+        # OpenRouter uses OpenAI-compatible format with different base URL.
+        # SDK retries are off: _retry_with_backoff owns the retry policy.
+        # Leaving both on multiplies attempts (SDK retries x outer retries)
+        return _shared_openai_client(
+            self.api_key,
+            base_url="https://openrouter.ai/api/v1",
+            default_headers=_openrouter_headers(),
+            max_retries=0,
+            timeout=60.0  # 60 second timeout
+        )
+    
+    async def _retry_with_backoff(self, operation, max_retries: int = 5, initial_delay: float = 1.0,
+                                  max_delay: float = 30.0):
         """
+        Retry operation with backoff (decorrelated jitter) for transient errors.
+        
+        Rate limits (429), request timeouts (408 or client-side) and gateway/server
+        errors (500, 502, 503, 504) are retried. Other 4xx responses and connection
+        failures are deterministic, so they are raised immediately.
         
-        def __init__(self, api_key: str, model: str = "gpt-4o-mini"):
-            self.client = AsyncOpenAI(api_key=api_key)
-            self.model = model
+        Args:
+            operation: Async function to retry
+            max_retries: Maximum number of retry attempts
+            initial_delay: Minimum delay in seconds between retries
+            max_delay: Upper bound for a single delay
+            
+        Returns:
+            Result of the operation
+            
+        Raises:
+            RateLimitError: If rate limit persists after all retries
+            APIError: For other API errors
+        """
+        openai = _import_openai()
         
-        async def generate_text(self, prompt: str, **kwargs) -> str:
-            """Generate text using OpenAI"""
+        delay = initial_delay
+        for attempt in range(max_retries):
+            last_attempt = attempt == max_retries - 1
+            # Every attempt, including retries, goes through the rate limiter
+            await self._bucket.acquire()
+            try:
+                result = await operation()
+            except openai.APITimeoutError:
+                # Checked before APIConnectionError (its base class), which is
+                # not retried: a refused connection won't fix itself in seconds
+                if last_attempt:
+                    raise
+                retry_after = None
+            except openai.APIStatusError as e:
+                if e.status_code not in _OPENROUTER_RETRYABLE_STATUS:
+                    raise
+                if e.status_code == 429:
+                    self._bucket.record_throttled()
+                    if last_attempt:
+                        raise openai.RateLimitError(
+                            f"OpenRouter rate limit exceeded after {max_retries} retries. "
+                            f"Free models have strict rate limits. "
+                            f"Consider: 1) Using a paid model, 2) Adding delays between requests, "
+                            f"3) Using a different provider (Gemini, FireworksAI), or "
+                            f"4) Upgrading your OpenRouter plan. "
+                            f"Model: {self.model}",
+                            response=e.response,
+                            body=e.body
+                        ) from e
+                elif last_attempt:
+                    raise
+                retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+            else:
+                self._bucket.record_success()
+                return result
+            
+            # Decorrelated jitter: each delay is drawn from [initial, 3x the
+            # previous delay], so it still grows roughly exponentially but
+            # concurrent requests that hit the limit together spread out
+            # instead of retrying in lockstep
+            delay = min(max_delay, random.uniform(initial_delay, delay * 3))
+            # Prefer the server's Retry-After (sent with 429 and 503) when present
+            if retry_after is not None:
+                delay = retry_after
+                # Pause other requests on this provider too
+                self._bucket.block_for(delay)
+            
+            await asyncio.sleep(delay)
+    
+    async def _prewarm(self) -> None:
+        """Prime the client's connection pool (DNS + TLS) with a cheap models.list()"""
+        try:
+            await self.client.with_options(max_retries=0, timeout=10.0).models.list()
+        except Exception as e:
+            logger.debug(f"OpenRouter prewarm failed: {e}")
+    
+    async def _generate_text_impl(self, prompt: str, **kwargs) -> str:
+        """Generate text using OpenRouter with retry logic for rate limits"""
+        async def _generate():
             response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=kwargs.get('temperature', 0.8),
-                max_tokens=kwargs.get('max_tokens', 1000),
+                **_chat_request(self._request_template, prompt, kwargs)
             )
             return response.choices[0].message.content
         
-        async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
-            """Stream text using OpenAI"""
+        return await self._retry_with_backoff(_generate)
+    
+    async def generate_text_n(self, prompt: str, n: int = 1, **kwargs) -> list[str]:
+        """Generate n completions in one request with the API's n parameter"""
+        async def _generate():
+            response = await self.client.chat.completions.create(
+                **_chat_request(self._request_template, prompt, kwargs),
+                n=n
+            )
+            return [choice.message.content for choice in response.choices]
+        
+        return await self._retry_with_backoff(_generate)
+    
+    @coalesced
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        """Stream text using OpenRouter with retry logic for rate limits"""
+        openai = _import_openai()
+        
+        async def _generate_stream():
             stream = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=kwargs.get('temperature', 0.8),
-                max_tokens=kwargs.get('max_tokens', 1000),
+                **_chat_request(self._request_template, prompt, kwargs),
                 stream=True
             )
-            
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    # Apply post-processing to fix spacing and punctuation
-                    content = _fix_streaming_chunk_spacing(chunk.choices[0].delta.content)
-                    yield content
+            return stream
         
-        async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
-            """Generate image using OpenAI GPT Image (image-to-image with edit API)"""
-            import base64
-            import io
-            
-            image_model = kwargs.get('image_model') or os.getenv("IMAGE_MODEL", "gpt-image-1")
-            image_file = io.BytesIO(image_bytes)
-            
-            response = await self.client.images.edit(
-                model=image_model,
-                image=image_file,
-                prompt=prompt,
-                size="1024x1024"
+        # Retry the initial request creation
+        try:
+            stream = await self._retry_with_backoff(_generate_stream)
+        except openai.RateLimitError as e:
+            # Yield error message as stream chunk for user feedback
+            error_msg = (
+                f"\n\n⚠️ Rate limit error: {str(e)}\n"
+                f"Please wait a moment and try again, or consider using a different provider.\n"
             )
-            
-            if response.data and len(response.data) > 0:
-                image_b64 = response.data[0].b64_json
-                return base64.b64decode(image_b64)
-            else:
-                raise Exception("No image data in OpenAI response")
+            yield error_msg
+            return
+        
+        # Stream chunks (no retry needed for individual chunks)
+        try:
+            async with contextlib.aclosing(buffered(stream)) as chunks:
+                async for chunk in chunks:
+                    # Each attribute is looked up once per token
+                    choices = chunk.choices
+                    if not choices:
+                        continue
+                    content = choices[0].delta.content
+                    if content:
+                        # Apply post-processing to fix spacing and punctuation
+                        yield _fix_streaming_chunk_spacing(content)
+        except (openai.RateLimitError, openai.APIError) as e:
+            # Handle errors during streaming
+            error_msg = (
+                f"\n\n⚠️ Error during streaming: {str(e)}\n"
+                f"Model: {self.model}\n"
+            )
+            yield error_msg
+    
+    async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
+        """Generate image using OpenRouter (supports various image models)"""
+        raise NotImplementedError(
+            "🎓 Learning Challenge: OpenRouter image generation is not yet implemented!\n\n"
+            "This is a great opportunity to learn:\n"
+            "1. Research OpenRouter's image generation API\n"
+            "2. Implement the generate_image() method for OpenRouterProvider\n"
+            "3. Test it with different image models (FLUX, DALL-E, etc.)\n"
+            "4. Compare results with Fireworks and OpenAI\n\n"
+            "For now, please use Fireworks AI (FLUX) or OpenAI (DALL-E)."
+        )
 
 
-# OpenRouter Provider (OpenAI-Compatible API)
-try:
-    from openai import AsyncOpenAI
-    OPENROUTER_AVAILABLE = True
-except ImportError:
-    OPENROUTER_AVAILABLE = False
-    AsyncOpenAI = None
-
-if OPENROUTER_AVAILABLE:
-    # Import error classes (may vary by OpenAI SDK version)
-    try:
-        from openai import RateLimitError, APIError
-    except ImportError:
-        # Fallback: use base exception for older SDK versions
-        # We'll check status codes manually if needed
+# FireworksAI Provider
+FIREWORKS_AVAILABLE = _module_available("aiohttp")
+aiohttp = None  # Imported lazily by _import_aiohttp()
+
+
+def _import_aiohttp():
+    """Import aiohttp on first use and cache it at module level."""
+    global aiohttp
+    if aiohttp is None:
+        aiohttp = _lazy_import("aiohttp", "aiohttp")
+    return aiohttp
+
+
+def _sse_chunk_size() -> int:
+    """Bytes requested per SSE read (FIREWORKS_SSE_CHUNK_SIZE, default 16 KiB)"""
+    return int(os.getenv("FIREWORKS_SSE_CHUNK_SIZE", "16384"))
+
+
+def _drain_sse_records(buffer: bytearray, data_lines: list) -> list:
+    """
+    Split complete lines off the front of buffer and return finished records.
+    
+    Partial lines stay in buffer, and data lines of an unfinished record stay
+    in data_lines, until more bytes arrive.
+    """
+    records = []
+    while True:
+        newline = buffer.find(b'\n')
+        if newline < 0:
+            # Partial line - wait for more bytes
+            return records
+        if newline and buffer[0] == 0x3A:
+            # ":" comment / keep-alive line: drop it without copying it out
+            del buffer[:newline + 1]
+            continue
+        line = bytes(buffer[:newline]).rstrip(b'\r')
+        del buffer[:newline + 1]
+        
+        if not line:
+            # Blank line marks the end of a record
+            if data_lines:
+                records.append(b'\n'.join(data_lines))
+                data_lines.clear()
+        elif line.startswith(b'data:'):
+            data = line[5:]
+            if data.startswith(b' '):
+                data = data[1:]
+            data_lines.append(data)
+        # Other fields (event:, id:, retry:) are ignored
+
+
+async def _iter_sse_data(content, chunk_size: Optional[int] = None) -> AsyncGenerator[bytes, None]:
+    """
+    Yield the data payload of each Server-Sent Event from an aiohttp stream.
+    
+    SSE records end with a blank line and may span several "data:" lines, so we
+    only emit complete records. A record that arrives split across TCP reads is
+    therefore never handed to the JSON parser in pieces.
+    
+    Bytes are read with iter_chunked() in blocks of up to chunk_size (one
+    await per read, not per line) and split into lines in a local buffer.
+    iter_chunked() returns whatever is already buffered, so a bigger
+    chunk_size batches bursts without holding back single tokens.
+    
+    Args:
+        content: aiohttp StreamReader (response.content)
+        chunk_size: Max bytes per read (default: FIREWORKS_SSE_CHUNK_SIZE or 16 KiB)
+        
+    Returns:
+        Async generator of raw data payloads (bytes)
+    """
+    buffer = bytearray()
+    data_lines = []
+    async for block in content.iter_chunked(chunk_size or _sse_chunk_size()):
+        buffer += block
+        for record in _drain_sse_records(buffer, data_lines):
+            yield record
+    
+    # EOF: terminate a trailing line and record that lack their newlines
+    buffer += b'\n\n'
+    for record in _drain_sse_records(buffer, data_lines):
+        yield record
+
+
+# aiohttp sessions shared by every FireworksAIProvider, one per event loop
+# (a ClientSession is bound to the loop it was created in). The connector pools
+# per host, so chat, image and polling requests from all instances reuse the
+# same warm connections; credentials are sent per request, not on the session.
+_FIREWORKS_SESSIONS: dict = {}
+
+
+def _shared_fireworks_session():
+    """Return the running loop's shared ClientSession, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    session = _FIREWORKS_SESSIONS.get(loop)
+    if session is None or session.closed:
+        # Forget sessions whose loop has finished (e.g. an earlier asyncio.run())
+        for stale in [l for l in _FIREWORKS_SESSIONS if l.is_closed()]:
+            del _FIREWORKS_SESSIONS[stale]
+        session = aiohttp.ClientSession(
+            # aiohttp's default 5-minute cap for one-shot calls; generate_stream
+            # overrides it per request so long streams aren't cut off
+            timeout=aiohttp.ClientTimeout(total=300, sock_connect=10),
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+        _FIREWORKS_SESSIONS[loop] = session
+    return session
+
+
+async def close_fireworks_sessions() -> None:
+    """Close the shared Fireworks sessions (called by close_llm_providers)"""
+    loop = asyncio.get_running_loop()
+    sessions = list(_FIREWORKS_SESSIONS.items())
+    _FIREWORKS_SESSIONS.clear()
+    for session_loop, session in sessions:
+        # A session can only be closed from its own loop; others are dropped
+        if session_loop is not loop or session.closed:
+            continue
         try:
-            from openai import OpenAIError
-            RateLimitError = OpenAIError
-            APIError = OpenAIError
-        except ImportError:
-            # Ultimate fallback
-            RateLimitError = Exception
-            APIError = Exception
+            await session.close()
+        except Exception as e:
+            logger.warning(f"Failed to close Fireworks session: {e}")
+
+
+class FireworksAIProvider(LLMProvider):
+    """
+    FireworksAI Provider
+    
+    Pros: Fast inference, good pricing
+    Cons: Requires internet connection
+    
+    How it works:
+    1. Send HTTP POST request to FireworksAI API
+    2. Use OpenAI-compatible format
+    3. Parse streaming response chunks
+    """
     
-    class OpenRouterProvider(LLMProvider):
+    __slots__ = ("api_key", "model", "base_url", "_headers", "_request_template", "_bucket")
+    
+    def __init__(self, api_key: str, model: str = "accounts/fireworks/models/qwen3-235b-a22b-instruct-2507"):
+        _import_aiohttp()
+        self.api_key = api_key
+        # Strip fireworks/ prefix if present (used by LiteLLM but not direct Fireworks API)
+        self.model = model[10:] if model and model.startswith("fireworks/") else model
+        self.base_url = "https://api.fireworks.ai/inference/v1/chat/completions"
+        # Static per-instance request headers, built once and passed with each
+        # request (the session itself is shared across API keys)
+        self._headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self._request_template = {"model": self.model, "max_tokens": 1000, "temperature": 0.7}
+        self._bucket = rate_limiter_from_env()
+    
+    async def _get_session(self):
         """
-        OpenRouter Provider
+        Return the shared ClientSession for the running event loop.
         
-        Pros: Access to many models (Claude, GPT-4, Llama, etc.), unified API
-        Cons: Requires internet connection, paid service, rate limits on free models
+        All Fireworks providers share one connection pool per loop, so a new
+        provider instance (e.g. a different model or key) still reuses warm
+        connections instead of paying DNS + TCP + TLS setup again.
+        """
+        return _shared_fireworks_session()
+    
+    async def _prewarm(self) -> None:
+        """Open a pooled connection to the Fireworks API host ahead of the first request"""
+        try:
+            session = await self._get_session()
+            async with session.head(self.base_url, headers=self._headers,
+                                    timeout=aiohttp.ClientTimeout(total=10)):
+                pass
+        except Exception as e:
+            logger.debug(f"FireworksAI prewarm failed: {e}")
+    
+    def _observe_status(self, response) -> None:
+        """
+        Feed the response status to the rate limiter.
         
-        How it works:
-        - Uses OpenAI-compatible API format
-        - Same code structure as OpenAI provider
-        - Just change the base URL and API key
-        - This demonstrates API compatibility patterns!
+        Success nudges the rate back up; a 429 halves it and pauses the bucket
+        for the Retry-After period.
+        """
+        if response.status == 200:
+            self._bucket.record_success()
+        elif response.status == 429:
+            self._bucket.record_throttled()
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self._bucket.block_for(1.0 if retry_after is None else retry_after)
+    
+    async def _generate_text_impl(self, prompt: str, **kwargs) -> str:
+        """Generate text using FireworksAI"""
+        payload = _chat_request(self._request_template, prompt, kwargs)
+        
+        await self._bucket.acquire()
+        session = await self._get_session()
+        # aiohttp sends bytes as-is, so no str -> bytes re-encode
+        async with session.post(self.base_url, headers=self._headers, data=_json_dumps(payload),
+                                timeout=aiohttp.ClientTimeout(total=300, sock_connect=10)) as response:
+            self._observe_status(response)
+            if response.status == 200:
+                # Parse the raw body: skips aiohttp's charset sniffing and
+                # str decode, and uses orjson when available
+                result = _json_loads(await response.read())
+                return result['choices'][0]['message']['content']
+            else:
+                error_text = await response.text()
+                raise Exception(f"FireworksAI API error {response.status}: {error_text}")
+    
+    async def generate_text_n(self, prompt: str, n: int = 1, **kwargs) -> list[str]:
+        """Generate n completions in one request with the API's n parameter"""
+        payload = _chat_request(self._request_template, prompt, kwargs)
+        payload["n"] = n
+        
+        await self._bucket.acquire()
+        session = await self._get_session()
+        async with session.post(self.base_url, headers=self._headers, data=_json_dumps(payload),
+                                timeout=aiohttp.ClientTimeout(total=300, sock_connect=10)) as response:
+            self._observe_status(response)
+            if response.status == 200:
+                result = _json_loads(await response.read())
+                return [choice['message']['content'] for choice in result['choices']]
+            else:
+                error_text = await response.text()
+                raise Exception(f"FireworksAI API error {response.status}: {error_text}")
+    
+    @coalesced
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        """Stream text using FireworksAI"""
+        payload = _chat_request(self._request_template, prompt, kwargs)
+        payload["stream"] = True
+        
+        await self._bucket.acquire()
+        session = await self._get_session()
+        # aiohttp sends bytes as-is, so no str -> bytes re-encode
+        # No total cap: long generations may stream for minutes. Fail
+        # instead if the connection goes silent between chunks.
+        async with session.post(self.base_url, headers=self._headers, data=_json_dumps(payload),
+                                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)) as response:
+            self._observe_status(response)
+            if response.status == 200:
+                # Work on raw bytes: both orjson and json accept bytes,
+                # so we skip a UTF-8 decode and a str copy per SSE record
+                # aclosing: stop the read-ahead task on [DONE] (or an early exit
+                # by the caller) before the response is released below
+                async with contextlib.aclosing(buffered(_iter_sse_data(response.content))) as records:
+                    async for data in records:
+                        if data == b'[DONE]':
+                            break
+                        try:
+                            chunk = _json_loads(data)
+                        except ValueError as e:
+                            # _iter_sse_data only emits complete records, so a
+                            # record that doesn't parse is a real fault, not a split
+                            raise Exception(
+                                f"FireworksAI stream sent malformed JSON: {data[:200]!r}"
+                            ) from e
+                        try:
+                            # Single lookup on the happy path; role-only, usage-only
+                            # and empty-choices chunks carry no content
+                            content = chunk['choices'][0]['delta']['content']
+                        except (KeyError, IndexError, TypeError):
+                            continue
+                        if content:
+                            # Apply post-processing to fix spacing and punctuation
+                            yield _fix_streaming_chunk_spacing(content)
+            else:
+                error_text = await response.text()
+                raise Exception(f"FireworksAI API error {response.status}: {error_text}")
+    
+    async def generate_text_from_stream(self, prompt: str, **kwargs) -> str:
+        """One JSON response instead of parsing an SSE stream"""
+        return await self.generate_text(prompt, **kwargs)
+    
+    async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
+        """Generate image using Fireworks AI FLUX Kontext Pro model (image-to-image)"""
+        import base64
         
-        Key Learning: OpenAI-compatible APIs let you use the same code
-        to access different AI providers. This is called "API compatibility".
+        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        image_model = kwargs.get('image_model') or os.getenv("IMAGE_MODEL", "accounts/fireworks/models/flux-kontext-pro")
         
-        Rate Limiting:
-        - Free models have strict rate limits (429 errors)
-        - This provider includes retry logic with exponential backoff
-        - Consider using paid models for production workloads
-        """
+        image_format = "jpeg"
+        if image_bytes.startswith(b'\x89PNG'):
+            image_format = "png"
+        elif image_bytes.startswith(b'RIFF') and b'WEBP' in image_bytes[:12]:
+            image_format = "webp"
         
-        def __init__(self, api_key: str, model: str = "minimax/minimax-m2:free"):
-            self.api_key = api_key
-            # Strip openrouter/ prefix if present (used by LiteLLM but not direct OpenRouter API)
-            self.model = model[11:] if model and model.startswith("openrouter/") else model
-            # OpenRouter uses OpenAI-compatible format with different base URL
-            # Prepare custom headers for OpenRouter
-            default_headers = {
-                "HTTP-Referer": os.getenv("OPENROUTER_HTTP_REFERER", ""),
-                "X-Title": os.getenv("OPENROUTER_APP_NAME", "AI Engineering by Param Harrison")
-            }
-            # Filter out empty values
-            headers = {k: v for k, v in default_headers.items() if v}
-            
-            # Configure client with retry settings for rate limits
-            # max_retries=3 with exponential backoff handles transient errors
-            self.client = AsyncOpenAI(
-                api_key=api_key,
-                base_url="https://openrouter.ai/api/v1",
-                default_headers=headers,
-                max_retries=3,  # Retry up to 3 times with exponential backoff
-                timeout=60.0  # 60 second timeout
-            )
+        url = f"https://api.fireworks.ai/inference/v1/workflows/{image_model}"
         
-        async def _retry_with_backoff(self, operation, max_retries: int = 5, initial_delay: float = 1.0):
-            """
-            Retry operation with exponential backoff for rate limit errors.
-            
-            Args:
-                operation: Async function to retry
-                max_retries: Maximum number of retry attempts
-                initial_delay: Initial delay in seconds before first retry
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "image/jpeg",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        
+        payload = {
+            "input_image": f"data:image/{image_format};base64,{base64_image}",
+            "prompt": prompt,
+            "seed": kwargs.get('seed', -1),
+            "aspect_ratio": kwargs.get('aspect_ratio', "1:1"),
+            "prompt_upsampling": kwargs.get('prompt_upsampling', False),
+            "safety_tolerance": kwargs.get('safety_tolerance', 2)
+        }
+        
+        session = await self._get_session()
+        async with session.post(url, headers=headers, data=_json_dumps(payload),
+                                timeout=aiohttp.ClientTimeout(total=300, sock_connect=10)) as response:
+            if response.status == 200:
+                result = await response.json()
+                if "request_id" not in result:
+                    raise Exception(f"Fireworks API error: No request_id in response: {result}")
                 
-            Returns:
-                Result of the operation
+                request_id = result["request_id"]
+                result_endpoint = f"{url}/get_result"
                 
-            Raises:
-                RateLimitError: If rate limit persists after all retries
-                APIError: For other API errors
-            """
-            last_exception = None
-            
-            for attempt in range(max_retries):
-                try:
-                    return await operation()
-                except Exception as e:
-                    # Check if this is a rate limit error (429)
-                    is_rate_limit = False
-                    status_code = None
-                    
-                    # Check if it's a RateLimitError
-                    if isinstance(e, RateLimitError):
-                        is_rate_limit = True
-                    # Check status code if available (for 429 errors)
-                    elif hasattr(e, 'status_code'):
-                        status_code = e.status_code
-                        is_rate_limit = (status_code == 429)
-                    elif hasattr(e, 'response') and hasattr(e.response, 'status_code'):
-                        status_code = e.response.status_code
-                        is_rate_limit = (status_code == 429)
-                    elif hasattr(e, 'code') and e.code == 'rate_limit_exceeded':
-                        is_rate_limit = True
-                    # Check error message for rate limit indicators
-                    elif '429' in str(e) or 'rate limit' in str(e).lower() or 'too many requests' in str(e).lower():
-                        is_rate_limit = True
+                for attempt in range(60):
+                    await asyncio.sleep(1)
                     
-                    if is_rate_limit:
-                        last_exception = e
-                        if attempt < max_retries - 1:
-                            # Exponential backoff: 1s, 2s, 4s, 8s, 16s
-                            delay = initial_delay * (2 ** attempt)
-                            # For 429 errors, check if Retry-After header is present
-                            if hasattr(e, 'response') and e.response:
-                                retry_after = e.response.headers.get('Retry-After')
-                                if retry_after:
-                                    try:
-                                        delay = float(retry_after)
-                                    except (ValueError, TypeError):
-                                        pass
-                            
-                            await asyncio.sleep(delay)
-                        else:
-                            # Last attempt failed
-                            raise RateLimitError(
-                                f"OpenRouter rate limit exceeded after {max_retries} retries. "
-                                f"Free models have strict rate limits. "
-                                f"Consider: 1) Using a paid model, 2) Adding delays between requests, "
-                                f"3) Using a different provider (Gemini, FireworksAI), or "
-                                f"4) Upgrading your OpenRouter plan. "
-                                f"Model: {self.model}"
-                            ) from e
-                    else:
-                        # For other API errors, don't retry
-                        if isinstance(e, APIError):
-                            # Just re-raise the API error as-is if it's already an instance
-                            raise e
-                        
-                        # Re-raise non-rate-limit errors immediately
-                        raise
-            
-            # Should not reach here, but just in case
-            if last_exception:
-                raise last_exception
-        
-        async def generate_text(self, prompt: str, **kwargs) -> str:
-            """Generate text using OpenRouter with retry logic for rate limits"""
-            async def _generate():
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=kwargs.get('temperature', 0.8),
-                    max_tokens=kwargs.get('max_tokens', 1000),
-                )
-                return response.choices[0].message.content
-            
-            return await self._retry_with_backoff(_generate)
-        
-        async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
-            """Stream text using OpenRouter with retry logic for rate limits"""
-            async def _generate_stream():
-                stream = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=kwargs.get('temperature', 0.8),
-                    max_tokens=kwargs.get('max_tokens', 1000),
-                    stream=True
-                )
-                return stream
-            
-            # Retry the initial request creation
-            try:
-                stream = await self._retry_with_backoff(_generate_stream)
-            except RateLimitError as e:
-                # Yield error message as stream chunk for user feedback
-                error_msg = (
-                    f"\n\n⚠️ Rate limit error: {str(e)}\n"
-                    f"Please wait a moment and try again, or consider using a different provider.\n"
-                )
-                yield error_msg
-                return
-            
-            # Stream chunks (no retry needed for individual chunks)
-            try:
-                async for chunk in stream:
-                    if chunk.choices and len(chunk.choices) > 0:
-                        if chunk.choices[0].delta.content:
-                            # Apply post-processing to fix spacing and punctuation
-                            content = _fix_streaming_chunk_spacing(chunk.choices[0].delta.content)
-                            yield content
-            except (RateLimitError, APIError) as e:
-                # Handle errors during streaming
-                error_msg = (
-                    f"\n\n⚠️ Error during streaming: {str(e)}\n"
-                    f"Model: {self.model}\n"
-                )
-                yield error_msg
-        
-        async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
-            """Generate image using OpenRouter (supports various image models)"""
-            raise NotImplementedError(
-                "🎓 Learning Challenge: OpenRouter image generation is not yet implemented!\n\n"
-                "This is a great opportunity to learn:\n"
-                "1. Research OpenRouter's image generation API\n"
-                "2. Implement the generate_image() method for OpenRouterProvider\n"
-                "3. Test it with different image models (FLUX, DALL-E, etc.)\n"
-                "4. Compare results with Fireworks and OpenAI\n\n"
-                "For now, please use Fireworks AI (FLUX) or OpenAI (DALL-E)."
-            )
-
-
-# FireworksAI Provider
-try:
-    import aiohttp
-    FIREWORKS_AVAILABLE = True
-except ImportError:
-    FIREWORKS_AVAILABLE = False
-    aiohttp = None
-
-if FIREWORKS_AVAILABLE:
-    class FireworksAIProvider(LLMProvider):
-        """
-        FireworksAI Provider
-        
-        Pros: Fast inference, good pricing
-        Cons: Requires internet connection
-        
-        How it works:
-        1. Send HTTP POST request to FireworksAI API
-        2. Use OpenAI-compatible format
-        3. Parse streaming response chunks
-        """
-        
-        def __init__(self, api_key: str, model: str = "accounts/fireworks/models/qwen3-235b-a22b-instruct-2507"):
-            self.api_key = api_key
-            # Strip fireworks/ prefix if present (used by LiteLLM but not direct Fireworks API)
-            self.model = model[10:] if model and model.startswith("fireworks/") else model
-            self.base_url = "https://api.fireworks.ai/inference/v1/chat/completions"
-        
-        async def generate_text(self, prompt: str, **kwargs) -> str:
-            """Generate text using FireworksAI"""
-            payload = {
-                "model": self.model,
-                "max_tokens": kwargs.get('max_tokens', 1000),
-                "temperature": kwargs.get('temperature', 0.7),
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            
-            headers = {
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, headers=headers, data=json.dumps(payload)) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result['choices'][0]['message']['content']
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"FireworksAI API error {response.status}: {error_text}")
-        
-        async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
-            """Stream text using FireworksAI"""
-            payload = {
-                "model": self.model,
-                "max_tokens": kwargs.get('max_tokens', 1000),
-                "temperature": kwargs.get('temperature', 0.7),
-                "stream": True,
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            
-            headers = {
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, headers=headers, data=json.dumps(payload)) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            line = line.decode('utf-8').strip()
-                            if line.startswith('data: '):
-                                data = line[6:]
-                                if data == '[DONE]':
-                                    break
-                                try:
-                                    chunk = json.loads(data)
-                                    if 'choices' in chunk and len(chunk['choices']) > 0:
-                                        delta = chunk['choices'][0].get('delta', {})
-                                        if 'content' in delta:
-                                            # Apply post-processing to fix spacing and punctuation
-                                            content = _fix_streaming_chunk_spacing(delta['content'])
-                                            yield content
-                                except json.JSONDecodeError:
-                                    continue
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"FireworksAI API error {response.status}: {error_text}")
-        
-        async def generate_image(self, image_bytes: bytes, prompt: str, **kwargs) -> bytes:
-            """Generate image using Fireworks AI FLUX Kontext Pro model (image-to-image)"""
-            import base64
-            
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            image_model = kwargs.get('image_model') or os.getenv("IMAGE_MODEL", "accounts/fireworks/models/flux-kontext-pro")
-            
-            image_format = "jpeg"
-            if image_bytes.startswith(b'\x89PNG'):
-                image_format = "png"
-            elif image_bytes.startswith(b'RIFF') and b'WEBP' in image_bytes[:12]:
-                image_format = "webp"
-            
-            url = f"https://api.fireworks.ai/inference/v1/workflows/{image_model}"
-            
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "image/jpeg",
-                "Authorization": f"Bearer {self.api_key}",
-            }
-            
-            payload = {
-                "input_image": f"data:image/{image_format};base64,{base64_image}",
-                "prompt": prompt,
-                "seed": kwargs.get('seed', -1),
-                "aspect_ratio": kwargs.get('aspect_ratio', "1:1"),
-                "prompt_upsampling": kwargs.get('prompt_upsampling', False),
-                "safety_tolerance": kwargs.get('safety_tolerance', 2)
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if "request_id" not in result:
-                            raise Exception(f"Fireworks API error: No request_id in response: {result}")
-                        
-                        request_id = result["request_id"]
-                        result_endpoint = f"{url}/get_result"
-                        
-                        for attempt in range(60):
-                            await asyncio.sleep(1)
+                    poll_payload = {"id": request_id}
+                    async with session.post(result_endpoint, headers=headers, data=_json_dumps(poll_payload)) as poll_response:
+                        if poll_response.status == 200:
+                            poll_result = await poll_response.json()
+                            status = poll_result.get("status")
                             
-                            poll_payload = {"id": request_id}
-                            async with session.post(result_endpoint, headers=headers, json=poll_payload) as poll_response:
-                                if poll_response.status == 200:
-                                    poll_result = await poll_response.json()
-                                    status = poll_result.get("status")
-                                    
-                                    if status in ["Ready", "Complete", "Finished"]:
-                                        image_data = poll_result.get("result", {}).get("sample")
-                                        if image_data:
-                                            if isinstance(image_data, str) and image_data.startswith("http"):
-                                                async with session.get(image_data) as img_response:
-                                                    if img_response.status == 200:
-                                                        return await img_response.read()
-                                                    else:
-                                                        raise Exception(f"Failed to download image from URL: {image_data}")
+                            if status in ["Ready", "Complete", "Finished"]:
+                                image_data = poll_result.get("result", {}).get("sample")
+                                if image_data:
+                                    if isinstance(image_data, str) and image_data.startswith("http"):
+                                        async with session.get(image_data) as img_response:
+                                            if img_response.status == 200:
+                                                return await img_response.read()
                                             else:
-                                                return base64.b64decode(image_data)
-                                    elif status in ["Failed", "Error"]:
-                                        error_details = poll_result.get("details", "Unknown error")
-                                        raise Exception(f"Fireworks generation failed: {error_details}")
-                                else:
-                                    if attempt == 59:
-                                        error_text = await poll_response.text()
-                                        raise Exception(f"Fireworks polling error {poll_response.status}: {error_text}")
-                        
-                        raise Exception("Fireworks image generation timed out after 60 attempts")
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"Fireworks API error {response.status}: {error_text}")
+                                                raise Exception(f"Failed to download image from URL: {image_data}")
+                                    else:
+                                        return base64.b64decode(image_data)
+                            elif status in ["Failed", "Error"]:
+                                error_details = poll_result.get("details", "Unknown error")
+                                raise Exception(f"Fireworks generation failed: {error_details}")
+                        else:
+                            if attempt == 59:
+                                error_text = await poll_response.text()
+                                raise Exception(f"Fireworks polling error {poll_response.status}: {error_text}")
+                
+                raise Exception("Fireworks image generation timed out after 60 attempts")
+            else:
+                error_text = await response.text()
+                raise Exception(f"Fireworks API error {response.status}: {error_text}")
 
 
 # ============================================================================
@@ -982,6 +1482,54 @@ Generic Provider Configuration:
 
 This is the core function that all other functions use internally.
 """
+# Resolved configs (default, per-provider, image, vision), each snapshotted on
+# first use. Not built at import time because applications usually call
+# load_dotenv() after importing this module.
+_CONFIG_SNAPSHOTS: dict = {}
+
+
+def _snapshot(key, resolve, *args) -> dict:
+    """
+    Return a copy of the config cached under key, resolving it on first use.
+    
+    Errors are not cached, so a missing key can still be fixed later. A copy is
+    returned because callers (e.g. get_image_provider_config) mutate the dict.
+    """
+    config = _CONFIG_SNAPSHOTS.get(key)
+    if config is None:
+        config = _CONFIG_SNAPSHOTS[key] = resolve(*args)
+    return dict(config)
+
+
+def _resolve_config() -> dict:
+    """Read LLM_PROVIDER and the matching provider's env vars into a config dict"""
+    provider_type = os.getenv("LLM_PROVIDER", "").lower().strip()
+    
+    # LLM_PROVIDER is required
+    if not provider_type:
+        raise ValueError(
+            "LLM_PROVIDER environment variable is required.\n"
+            "Set LLM_PROVIDER to one of: 'fireworks', 'openrouter', 'gemini', 'openai'"
+        )
+    
+    # Use the explicit provider selection function
+    return get_provider_config_for(provider_type)
+
+
+def refresh_provider_config() -> dict:
+    """
+    Re-read the provider configuration from the environment.
+    
+    The get_*_config() functions snapshot the environment on their first
+    successful call; use this after changing LLM_PROVIDER, API keys or model
+    env vars at runtime (or in tests). Also re-reads the OpenRouter attribution
+    headers (OPENROUTER_HTTP_REFERER / OPENROUTER_APP_NAME).
+    """
+    _CONFIG_SNAPSHOTS.clear()
+    _openrouter_headers.cache_clear()
+    return get_provider_config()
+
+
 def get_provider_config():
     """
     Get generic provider configuration
@@ -1001,18 +1549,51 @@ def get_provider_config():
         
         config = get_provider_config()
         # Use config['api_key'], config['model'], config['base_url'] for any API client
-    """
-    provider_type = os.getenv("LLM_PROVIDER", "").lower().strip()
     
-    # LLM_PROVIDER is required
-    if not provider_type:
-        raise ValueError(
-            "LLM_PROVIDER environment variable is required.\n"
-            "Set LLM_PROVIDER to one of: 'fireworks', 'openrouter', 'gemini', 'openai'"
-        )
-    
-    # Use the explicit provider selection function
-    return get_provider_config_for(provider_type)
+    The environment is read once and snapshotted; call refresh_provider_config()
+    to pick up changes.
+    """
+    return _snapshot("default", _resolve_config)
+
+
+class _ProviderSpec(NamedTuple):
+    """One supported provider: where its settings come from and which class serves it"""
+    name: str
+    label: str  # Display name used in error messages
+    key_env: str  # API key env var
+    available: bool  # Dependencies installed
+    model_env: str
+    default_model: str
+    base_url: Optional[str]
+    base_url_env: Optional[str]  # Env var that overrides base_url, if any
+    provider_cls: type
+
+
+# Config resolution and the factories both read this table, so adding a
+# provider is one row.
+_PROVIDER_TABLE = (
+    _ProviderSpec("fireworks", "Fireworks", "FIREWORKS_API_KEY", FIREWORKS_AVAILABLE,
+        "FIREWORKS_MODEL", "accounts/fireworks/models/qwen3-235b-a22b-instruct-2507",
+        "https://api.fireworks.ai/inference/v1", None, FireworksAIProvider),
+    _ProviderSpec("openrouter", "OpenRouter", "OPENROUTER_API_KEY", OPENROUTER_AVAILABLE,
+        "OPENROUTER_MODEL", "deepseek/deepseek-r1-0528-qwen3-8b:free",
+        "https://openrouter.ai/api/v1", None, OpenRouterProvider),
+    _ProviderSpec("gemini", "Gemini", "GEMINI_API_KEY", GEMINI_AVAILABLE,
+        "GEMINI_MODEL", "gemini-2.5-flash",
+        None, None, GeminiProvider),
+    _ProviderSpec("openai", "OpenAI", "OPENAI_API_KEY", OPENAI_AVAILABLE,
+        "OPENAI_MODEL", "gpt-4o-mini",
+        None, "OPENAI_BASE_URL", OpenAIProvider),
+)
+
+_PROVIDERS_BY_NAME = {spec.name: spec for spec in _PROVIDER_TABLE}
+
+# Provider name -> class, only for providers whose dependencies are installed
+_PROVIDER_CLASSES = {
+    spec.name: spec.provider_cls
+    for spec in _PROVIDER_TABLE
+    if spec.available
+}
 
 
 def get_provider_config_for(provider_name: str):
@@ -1038,64 +1619,30 @@ def get_provider_config_for(provider_name: str):
         config = get_provider_config_for('gemini')
     """
     provider_name = provider_name.lower().strip()
-    
-    if provider_name == "fireworks":
-        api_key = os.getenv("FIREWORKS_API_KEY")
-        if not api_key:
-            raise ValueError("FIREWORKS_API_KEY not set")
-        if not FIREWORKS_AVAILABLE:
-            raise ValueError("Fireworks dependencies not installed")
-        return {
-            "api_key": api_key,
-            "model": os.getenv("FIREWORKS_MODEL", "accounts/fireworks/models/qwen3-235b-a22b-instruct-2507"),
-            "base_url": "https://api.fireworks.ai/inference/v1",
-            "provider_name": "fireworks"
-        }
-    
-    elif provider_name == "openrouter":
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
-            raise ValueError("OPENROUTER_API_KEY not set")
-        if not OPENROUTER_AVAILABLE:
-            raise ValueError("OpenRouter dependencies not installed")
-        return {
-            "api_key": api_key,
-            "model": os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-r1-0528-qwen3-8b:free"),
-            "base_url": "https://openrouter.ai/api/v1",
-            "provider_name": "openrouter"
-        }
-    
-    elif provider_name == "gemini":
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not set")
-        if not GEMINI_AVAILABLE:
-            raise ValueError("Gemini dependencies not installed")
-        return {
-            "api_key": api_key,
-            "model": os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
-            "base_url": None,
-            "provider_name": "gemini"
-        }
-    
-    elif provider_name == "openai":
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not set")
-        if not OPENAI_AVAILABLE:
-            raise ValueError("OpenAI dependencies not installed")
-        return {
-            "api_key": api_key,
-            "model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            "base_url": os.getenv("OPENAI_BASE_URL"),
-            "provider_name": "openai"
-        }
-    
-    else:
+    return _snapshot(("provider", provider_name), _build_provider_config, provider_name)
+
+
+def _build_provider_config(provider_name: str) -> dict:
+    spec = _PROVIDERS_BY_NAME.get(provider_name)
+    if spec is None:
         raise ValueError(
             f"Unknown provider: {provider_name}. "
-            f"Supported providers: fireworks, openrouter, gemini, openai"
+            f"Supported providers: {', '.join(_PROVIDERS_BY_NAME)}"
         )
+    api_key = os.getenv(spec.key_env)
+    if not api_key:
+        raise ValueError(f"{spec.key_env} not set")
+    if not spec.available:
+        raise ValueError(f"{spec.label} dependencies not installed")
+    base_url = spec.base_url
+    if spec.base_url_env:
+        base_url = os.getenv(spec.base_url_env, base_url)
+    return {
+        "api_key": api_key,
+        "model": os.getenv(spec.model_env, spec.default_model),
+        "base_url": base_url,
+        "provider_name": provider_name
+    }
 
 
 def get_image_provider_config():
@@ -1114,6 +1661,10 @@ def get_image_provider_config():
         config = get_image_provider_config()
         # Use config to create image generation provider
     """
+    return _snapshot("image", _resolve_image_config)
+
+
+def _resolve_image_config() -> dict:
     provider_name = os.getenv("IMAGE_LLM_PROVIDER", "").lower().strip()
     
     # If IMAGE_LLM_PROVIDER is set, use that specific provider
@@ -1149,6 +1700,10 @@ def get_vision_provider_config():
         config = get_vision_provider_config()
         # Use config for invoice parsing, document analysis, etc.
     """
+    return _snapshot("vision", _resolve_vision_config)
+
+
+def _resolve_vision_config() -> dict:
     provider_name = os.getenv("VISION_LLM_PROVIDER", "").lower().strip()
     
     # If VISION_LLM_PROVIDER is set, use that specific provider
@@ -1195,6 +1750,84 @@ OpenRouter also supports:
 - OPENROUTER_HTTP_REFERER=your-url (optional)
 - OPENROUTER_APP_NAME=your-app-name (optional)
 """
+# (purpose, provider_name, model) combinations already announced in the logs
+_PROVIDER_LOGGED: set[tuple[str, str, str]] = set()
+
+
+def _log_provider_once(purpose: str, provider_name: str, model: str) -> None:
+    """Log which provider/model is in use, once per combination instead of per call."""
+    key = (purpose, provider_name, model)
+    if key not in _PROVIDER_LOGGED:
+        _PROVIDER_LOGGED.add(key)
+        logger.info(f"Using {provider_name} provider for {purpose} with model: {model}")
+
+
+# Providers built by the get_*_provider() factories, keyed by
+# (provider_name, api_key, model, base_url). Reusing an instance keeps its
+# client and connection pool warm instead of rebuilding them on every call.
+# Instances are shared across event loops (demo modules build them at import
+# time), so they hold no loop-bound state: clients, sessions and locks are
+# looked up or created per running loop.
+_PROVIDER_CACHE: dict[tuple, LLMProvider] = {}
+_PROVIDER_CACHE_LOCK = threading.Lock()
+
+
+def reset_llm_provider_cache() -> None:
+    """
+    Forget cached provider instances.
+    
+    Only the instances are dropped; the config snapshots they were built from
+    are kept. After changing env vars (e.g. in tests), call
+    refresh_provider_config() as well, or the next provider is built from the
+    old configuration.
+    """
+    with _PROVIDER_CACHE_LOCK:
+        _PROVIDER_CACHE.clear()
+
+
+async def close_llm_providers() -> None:
+    """
+    Close every cached provider's network resources and empty the cache.
+    
+    Call this on application shutdown (see the FastAPI lifespan in main.py).
+    """
+    with _PROVIDER_CACHE_LOCK:
+        providers = list(_PROVIDER_CACHE.values())
+        _PROVIDER_CACHE.clear()
+    for provider in providers:
+        try:
+            await provider.aclose()
+        except Exception as e:
+            logger.warning(f"Failed to close {type(provider).__name__}: {e}")
+    # OpenAI/OpenRouter clients and Fireworks sessions are shared across
+    # instances, so they are closed here rather than by each provider
+    await close_openai_clients()
+    await close_fireworks_sessions()
+
+
+# Strong references to in-flight prewarm tasks (the event loop only keeps weak ones)
+_PREWARM_TASKS: set = set()
+
+
+def _schedule_prewarm(provider: LLMProvider) -> None:
+    """
+    Warm up the provider's connection in the background, if an event loop is running.
+    
+    Opt-in with LLM_PREWARM=1: for OpenAI/OpenRouter the warm-up is an
+    authenticated models.list() call, which counts against quota and rate limits.
+    Factories are often called at import time (no loop), in which case this is a no-op.
+    """
+    if os.getenv("LLM_PREWARM") != "1":
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(provider._prewarm())
+    _PREWARM_TASKS.add(task)
+    task.add_done_callback(_PREWARM_TASKS.discard)
+
+
 def get_llm_provider(model: Optional[str] = None) -> LLMProvider:
     """
     Factory function: Automatically selects and creates the right provider
@@ -1205,6 +1838,9 @@ def get_llm_provider(model: Optional[str] = None) -> LLMProvider:
     2. Provider preference (LLM_PROVIDER env var)
     3. Availability of libraries
     
+    Instances are cached per configuration, so repeated calls return the
+    same provider (and reuse its HTTP connections).
+    
     Args:
         model: Optional specific model to use (overrides environment default)
     
@@ -1218,21 +1854,34 @@ def get_llm_provider(model: Optional[str] = None) -> LLMProvider:
     # Use provided model or fall back to config model
     target_model = model if model else config["model"]
     
-    # Create provider instance based on config
-    if provider_name == "fireworks" and FIREWORKS_AVAILABLE:
-        print(f"🤖 Using FireworksAI provider with model: {target_model}")
-        return FireworksAIProvider(api_key=config["api_key"], model=target_model)
-    elif provider_name == "openrouter" and OPENROUTER_AVAILABLE:
-        print(f"🤖 Using OpenRouter provider with model: {target_model}")
-        return OpenRouterProvider(api_key=config["api_key"], model=target_model)
-    elif provider_name == "gemini" and GEMINI_AVAILABLE:
-        print(f"🤖 Using Google Gemini provider with model: {target_model}")
-        return GeminiProvider(api_key=config["api_key"], model=target_model)
-    elif provider_name == "openai" and OPENAI_AVAILABLE:
-        print(f"🤖 Using OpenAI provider with model: {target_model}")
-        return OpenAIProvider(api_key=config["api_key"], model=target_model)
-    else:
-        raise ValueError(f"Provider {provider_name} is not available. Install required dependencies.")
+    _log_provider_once("text generation", provider_name, target_model)
+    return _cached_provider({**config, "model": target_model})
+
+
+def _cached_provider(config: dict) -> LLMProvider:
+    """
+    Return the shared provider instance for this configuration, creating it once.
+    
+    Keyed by (provider_name, api_key, model, base_url), so the text, image and
+    vision factories all hand out the same instance (and connection pool and
+    rate limiter) for the same settings.
+    """
+    cache_key = (config["provider_name"], config["api_key"], config["model"], config.get("base_url"))
+    provider = _PROVIDER_CACHE.get(cache_key)
+    if provider is not None:
+        return provider
+    
+    with _PROVIDER_CACHE_LOCK:
+        # Another thread may have built it while we waited for the lock
+        provider = _PROVIDER_CACHE.get(cache_key)
+        if provider is not None:
+            return provider
+        provider = _create_provider_from_config(config)
+        _PROVIDER_CACHE[cache_key] = provider
+    
+    # With LLM_PREWARM=1, overlap DNS + TLS setup with whatever the caller does before its first request
+    _schedule_prewarm(provider)
+    return provider
 
 
 def _create_provider_from_config(config: dict) -> LLMProvider:
@@ -1246,18 +1895,10 @@ def _create_provider_from_config(config: dict) -> LLMProvider:
         LLMProvider instance
     """
     provider_name = config["provider_name"]
-    target_model = config["model"]
-    
-    if provider_name == "fireworks" and FIREWORKS_AVAILABLE:
-        return FireworksAIProvider(api_key=config["api_key"], model=target_model)
-    elif provider_name == "openrouter" and OPENROUTER_AVAILABLE:
-        return OpenRouterProvider(api_key=config["api_key"], model=target_model)
-    elif provider_name == "gemini" and GEMINI_AVAILABLE:
-        return GeminiProvider(api_key=config["api_key"], model=target_model)
-    elif provider_name == "openai" and OPENAI_AVAILABLE:
-        return OpenAIProvider(api_key=config["api_key"], model=target_model)
-    else:
+    provider_cls = _PROVIDER_CLASSES.get(provider_name)
+    if provider_cls is None:
         raise ValueError(f"Provider {provider_name} is not available. Install required dependencies.")
+    return provider_cls(api_key=config["api_key"], model=config["model"])
 
 
 def get_image_provider(model: Optional[str] = None) -> LLMProvider:
@@ -1283,8 +1924,8 @@ def get_image_provider(model: Optional[str] = None) -> LLMProvider:
     if model:
         config["model"] = model
     
-    print(f"🖼️ Using {config['provider_name']} for image generation with model: {config['model']}")
-    return _create_provider_from_config(config)
+    _log_provider_once("image generation", config["provider_name"], config["model"])
+    return _cached_provider(config)
 
 
 def get_vision_provider(model: Optional[str] = None) -> LLMProvider:
@@ -1310,8 +1951,8 @@ def get_vision_provider(model: Optional[str] = None) -> LLMProvider:
     if model:
         config["model"] = model
     
-    print(f"👁️ Using {config['provider_name']} for vision tasks with model: {config['model']}")
-    return _create_provider_from_config(config)
+    _log_provider_once("vision", config["provider_name"], config["model"])
+    return _cached_provider(config)
 
 
 # ============================================================================
@@ -0,0 +1,429 @@
+"""
+LLM Runtime Helpers
+===================
+
+🎯 LEARNING OBJECTIVES:
+Once the provider pattern in llm_provider.py makes sense, this module shows
+the plumbing that keeps providers fast and polite in production:
+
+1. Stream Buffering - Read ahead of a slow consumer without unbounded memory
+2. Stream Coalescing - Merge tiny token chunks into fewer, larger writes
+3. Rate Limiting - A token bucket that adapts to the provider's 429s
+4. Response Caching - Skip the network for repeated deterministic prompts
+
+📚 LEARNING FLOW:
+Each section is independent; read them in any order. llm_provider.py imports
+what it needs from here, so the providers stay focused on the API calls.
+
+Everything here is loop-agnostic: no state is bound to one asyncio event loop
+at import time, so cached providers can be reused across loops.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import AsyncGenerator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# STREAM BUFFERING
+# ============================================================================
+"""
+Bounded read-ahead buffer between a network stream and its consumer.
+
+Without a buffer, the network is only read while the consumer asks for the
+next chunk. If the consumer is busy (e.g. writing to a slow client), tokens
+pile up in the socket instead of being parsed. A small bounded queue lets a
+background task keep reading ahead, and the bound provides backpressure so a
+stalled consumer can't make it buffer without limit.
+"""
+def stream_buffer_size() -> int:
+    """Chunks to read ahead per stream (LLM_STREAM_BUFFER, default 16; 0 disables)"""
+    return int(os.getenv("LLM_STREAM_BUFFER", "16"))
+
+
+async def buffered(source, size: Optional[int] = None) -> AsyncGenerator:
+    """
+    Re-yield items from an async iterator through an asyncio.Queue(maxsize=size).
+    
+    A producer task drains source into the queue. Errors raised by source are
+    re-raised to the consumer. When this generator finishes (including when the
+    consumer stops early and closes it), the producer is cancelled and awaited,
+    then source is closed if it has aclose(). Consumers that may stop early
+    should use contextlib.aclosing(buffered(...)) so that happens immediately
+    rather than when the generator is garbage-collected.
+    """
+    if size is None:
+        size = stream_buffer_size()
+    if size <= 0:
+        try:
+            async for item in source:
+                yield item
+        finally:
+            await _aclose(source)
+        return
+    
+    queue = asyncio.Queue(maxsize=size)
+    done = object()  # Sentinel marking the end of the stream
+    error = None
+    
+    async def _drain():
+        nonlocal error
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as e:
+            error = e
+        await queue.put(done)
+    
+    producer = asyncio.create_task(_drain())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+        if error is not None:
+            raise error
+    finally:
+        producer.cancel()
+        # Wait for the producer to unwind without re-raising its CancelledError
+        # here. A producer cancelled while parked in queue.put() never closes
+        # source itself, so close it explicitly.
+        await asyncio.wait([producer])
+        await _aclose(source)
+
+
+async def _aclose(source) -> None:
+    """Close an async iterator if it supports aclose() (async generators, SDK streams)"""
+    aclose = getattr(source, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+# ============================================================================
+# STREAM COALESCING
+# ============================================================================
+"""
+Optional merging of tiny streamed chunks (LLM_COALESCE_STREAM=1).
+
+Providers stream one token (sometimes less) per chunk, and every chunk costs
+an event-loop hop and, when relayed to a client, a network write. Coalescing
+merges chunks that arrive within a short window into one larger chunk.
+
+- The first chunk is passed straight through, so time-to-first-token is unchanged
+- Later chunks are flushed once they reach max_chars, or max_delay_ms after
+  the first chunk of the batch arrived, whichever comes first
+"""
+def coalesce_enabled() -> bool:
+    return os.getenv("LLM_COALESCE_STREAM") == "1"
+
+
+async def coalesce(source, *, max_chars: int = 64, max_delay_ms: float = 10) -> AsyncGenerator[str, None]:
+    """Merge text chunks from source into batches of up to max_chars / max_delay_ms"""
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    max_delay = max_delay_ms / 1000
+    buffer = []
+    size = 0
+    deadline = 0.0
+    pending = None  # In-flight __anext__() while a batch is waiting to flush
+    first = True
+    
+    try:
+        while True:
+            if buffer:
+                # Wait for the next chunk, but no longer than the batch deadline.
+                # On timeout the pending fetch is kept (not cancelled) so no
+                # chunk is lost; the next loop iteration waits on it again.
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                done, _ = await asyncio.wait({pending}, timeout=max(0.0, deadline - loop.time()))
+                if not done:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+                    continue
+                fetch, pending = pending, None
+                try:
+                    chunk = fetch.result()
+                except StopAsyncIteration:
+                    break
+            else:
+                # Nothing buffered: no timer needed, await the source directly
+                if pending is not None:
+                    fetch, pending = pending, None
+                    try:
+                        chunk = await fetch
+                    except StopAsyncIteration:
+                        break
+                else:
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+            
+            if first:
+                first = False
+                yield chunk
+                continue
+            
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= max_chars:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait([pending])
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+
+
+def coalesced(stream_method):
+    """Decorator for generate_stream methods: coalesce output when LLM_COALESCE_STREAM=1"""
+    @functools.wraps(stream_method)
+    def wrapper(self, prompt, **kwargs):
+        stream = stream_method(self, prompt, **kwargs)
+        return coalesce(stream) if coalesce_enabled() else stream
+    return wrapper
+
+
+# ============================================================================
+# RATE LIMITING
+# ============================================================================
+"""
+Client-side rate limiting with a token bucket.
+
+Providers reject requests over quota with HTTP 429, and a rejected request
+still costs a full round-trip (and on some providers still counts against
+quota). Waiting briefly on our side is cheaper than being told to wait.
+
+How it works:
+- The bucket holds up to `burst` tokens and refills at `rate` tokens/second
+- Each request takes one token; if none are left, it sleeps until one refills
+- A 429 with Retry-After can pause the whole bucket via block_for()
+- The rate adapts (AIMD): each 429 halves it, each successful request adds
+  back a small step, up to the configured LLM_RPS. A provider whose real quota
+  is below LLM_RPS settles just under it instead of hitting 429s repeatedly.
+"""
+class AsyncTokenBucket:
+    """
+    Async token bucket shared by all requests made through one provider instance
+    
+    A rate <= 0 disables throttling (acquire() only honours block_for() pauses).
+    Waiters are served in arrival order because they queue on a single lock.
+    
+    record_throttled() / record_success() adjust the live rate between
+    max_rate / 20 and max_rate (the configured rate).
+    """
+    
+    # Touched on every request; slots keep attribute access off the instance dict
+    __slots__ = ("rate", "max_rate", "burst", "_tokens", "_updated", "_blocked_until",
+                 "_last_decrease", "_lock", "_lock_loop")
+    
+    def __init__(self, rate: float, burst: int = 10):
+        self.rate = float(rate)
+        self.max_rate = self.rate
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = None
+        self._blocked_until = 0.0
+        self._last_decrease = float("-inf")
+        # Created per event loop by _lock_for(): an asyncio.Lock binds to the
+        # loop that first waits on it, and the bucket lives on a cached
+        # provider that can outlive that loop
+        self._lock = None
+        self._lock_loop = None
+    
+    def _lock_for(self, loop):
+        if self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+    
+    async def acquire(self, n: int = 1) -> None:
+        """Wait until n tokens are available, then take them"""
+        loop = asyncio.get_running_loop()
+        if self.rate <= 0 and loop.time() >= self._blocked_until:
+            return
+        
+        async with self._lock_for(loop):
+            while True:
+                now = loop.time()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                
+                # Refill for the time elapsed since the last update
+                if self._updated is not None:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                await asyncio.sleep((n - self._tokens) / self.rate)
+    
+    def block_for(self, seconds: float) -> None:
+        """Pause all acquires for `seconds` (e.g. from a 429 Retry-After header)"""
+        if seconds > 0:
+            until = asyncio.get_running_loop().time() + seconds
+            self._blocked_until = max(self._blocked_until, until)
+    
+    def record_throttled(self) -> None:
+        """Multiplicative decrease: halve the rate after a 429"""
+        if self.max_rate <= 0:
+            return
+        now = asyncio.get_running_loop().time()
+        # Concurrent requests rejected together count as one signal
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.rate = max(self.max_rate / 20, self.rate / 2)
+    
+    def record_success(self) -> None:
+        """Additive increase: creep back towards max_rate after a success"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header into seconds to wait, or None if absent/invalid.
+    
+    Servers almost always send integer seconds, so that form is checked first;
+    fractional seconds and the HTTP-date form (RFC 7231) are also accepted.
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def rate_limiter_from_env() -> AsyncTokenBucket:
+    """
+    Build a provider's rate limiter from LLM_RPS / LLM_BURST.
+    
+    LLM_RPS defaults to 5 requests/second with bursts of 10; set LLM_RPS=0
+    to turn client-side throttling off.
+    """
+    return AsyncTokenBucket(
+        rate=float(os.getenv("LLM_RPS", "5")),
+        burst=int(os.getenv("LLM_BURST", "10")),
+    )
+
+
+# ============================================================================
+# RESPONSE CACHING
+# ============================================================================
+"""
+Opt-in cache for generate_text responses.
+
+Eval and benchmark scripts often send the same prompt many times. A cache hit
+is a dictionary lookup instead of a network round-trip, and it costs no tokens.
+
+Configuration (read on every call, so load_dotenv() can run after import):
+- LLM_RESPONSE_CACHE=1: keep up to 1024 responses in memory (LRU)
+- LLM_CACHE_DIR=/path: also persist responses as JSON files (implies the above)
+- LLM_CACHE_SAMPLED=1: also cache calls with temperature > 0
+- LLM_CACHE_TTL=seconds: how long an entry stays valid (default 3600)
+
+Without LLM_CACHE_SAMPLED, only temperature=0 calls are cached, because a
+sampled response is supposed to differ between calls. Pass cache=False to
+generate_text() to bypass the cache for a single call. Keys include the API
+key, so tenants using different keys never see each other's responses, and
+every keyword argument passed to generate_text(), so calls with different
+options (max_tokens, safety_settings, ...) never share an entry.
+"""
+class ResponseCache:
+    """Thread-safe in-memory LRU with TTL expiry and an optional on-disk JSON layer"""
+    
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(namespace: str, model: str, kwargs: dict, prompt: str) -> str:
+        # Every generation kwarg (temperature, max_tokens, safety_settings, ...)
+        # is part of the key, so calls that differ in any option never share
+        # an entry. Sorted so keyword order doesn't matter.
+        options = repr(sorted(kwargs.items()))
+        raw = f"{namespace}|{model}|{options}|{prompt}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str, ttl: float, cache_dir: Optional[str] = None) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created < ttl:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+        
+        # Fall back to disk; a hit is promoted into memory
+        if cache_dir:
+            try:
+                with open(os.path.join(cache_dir, f"{key}.json"), 'rb') as f:
+                    entry = json.loads(f.read())
+                created, value = entry['created'], entry['text']
+            except (OSError, ValueError, KeyError, TypeError):
+                return None
+            if now - created >= ttl:
+                return None
+            self._store(key, value, created)
+            return value
+        return None
+    
+    def set(self, key: str, value: str, cache_dir: Optional[str] = None) -> None:
+        created = time.time()
+        self._store(key, value, created)
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(os.path.join(cache_dir, f"{key}.json"), 'w', encoding='utf-8') as f:
+                    json.dump({"text": value, "created": created}, f)
+            except OSError as e:
+                logger.warning(f"Could not write LLM response cache entry: {e}")
+    
+    def _store(self, key: str, value: str, created: float) -> None:
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+RESPONSE_CACHE = ResponseCache(maxsize=1024)